@@ -0,0 +1,280 @@
+"""
+ICP benchmark suite with scaling curves
+
+Sweeps point count, dimension, noise and initial misalignment over every
+available registration backend and appends one JSON record per run to an
+output file (JSON lines), so results can be tracked for regressions:
+
+    python icp_benchmark.py --points 1000 10000 --dims 3 -o bench.jsonl
+
+Every record holds the wall time, the peak memory traced by tracemalloc in a
+separate untimed run (numpy buffers and Python objects, not allocations
+inside C++ libraries such as the KD-tree or open3d), the number of
+iterations and the final rotation and translation error against the ground
+truth. Failing cases are recorded with their error.
+"""
+
+import argparse
+import json
+import math
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+from scipy.spatial.transform import Rotation as Rot
+
+from iterative_closest_point import (icp_registration,
+                                     pyramid_icp_registration)
+from ndt import make_ndt_pyramid, ndt_registration
+
+POINTS = (1000, 10000, 100000, 1000000)
+DIMS = (2, 3)
+NOISES = (0.0, 0.05)  # [m]
+MISALIGNMENTS = ((5.0, 0.5), (10.0, 2.0))  # (rotation [deg], translation [m])
+FIELD_LENGTH = 50.0  # [m]
+CLUSTER_SIZE = 20  # points per cluster of the simulated scene
+BRUTE_MAX_POINTS = 5000  # the brute-force matrix is O(N^2) in memory
+
+
+def run_brute(previous_points, current_points):
+    return icp_registration(previous_points, current_points, nn_method="brute")
+
+
+def run_kdtree(previous_points, current_points):
+    return icp_registration(previous_points, current_points, nn_method="kdtree")
+
+
+def run_point_to_plane(previous_points, current_points):
+    return icp_registration(previous_points, current_points,
+                            motion_method="point_to_plane")
+
+
+def run_gicp(previous_points, current_points):
+    return icp_registration(previous_points, current_points,
+                            motion_method="gicp")
+
+
+def run_pyramid(previous_points, current_points):
+    return pyramid_icp_registration(previous_points, current_points)
+
+
+def run_ndt(previous_points, current_points):
+    return ndt_registration(make_ndt_pyramid(previous_points), current_points)
+
+
+def run_open3d(previous_points, current_points):
+    import open3d as o3d
+
+    target = o3d.geometry.PointCloud()
+    target.points = o3d.utility.Vector3dVector(previous_points.T)
+    source = o3d.geometry.PointCloud()
+    source.points = o3d.utility.Vector3dVector(current_points.T)
+    # same point-to-point estimation as toyicp.py, without the threshold
+    # limiting the basin of convergence
+    result = o3d.pipelines.registration.registration_icp(
+        source, target, FIELD_LENGTH, np.eye(4),
+        o3d.pipelines.registration.TransformationEstimationPointToPoint(),
+        o3d.pipelines.registration.ICPConvergenceCriteria(max_iteration=100))
+    return result.transformation, None, None
+
+
+BACKENDS = {
+    "brute": run_brute,
+    "kdtree": run_kdtree,
+    "point_to_plane": run_point_to_plane,
+    "gicp": run_gicp,
+    "pyramid": run_pyramid,
+    "ndt": run_ndt,
+    "open3d": run_open3d,
+}
+
+
+def available_backends():
+    names = [name for name in BACKENDS if name != "open3d"]
+    try:
+        import open3d  # noqa: F401
+        names.append("open3d")
+    except (ImportError, OSError):
+        pass
+    return names
+
+
+def simulate(n_points, dim, noise, rotation, translation, rng):
+    """
+    Clustered scene and a misaligned noisy copy of it
+
+    rotation: rotation angle [deg] about a random axis (z in 2D)
+    translation: translation length [m] in a random direction
+    return: previous_points, current_points, H_true (current -> previous)
+    """
+    n_clusters = max(n_points // CLUSTER_SIZE, 1)
+    centers = (rng.random((dim, n_clusters)) - 0.5) * FIELD_LENGTH
+    previous_points = np.repeat(centers, CLUSTER_SIZE, axis=1)[:, :n_points]
+    previous_points = previous_points + rng.normal(
+        0.0, 0.3, previous_points.shape)
+
+    if dim == 2:
+        a = np.deg2rad(rotation)
+        R = np.array([[math.cos(a), -math.sin(a)], [math.sin(a), math.cos(a)]])
+    else:
+        axis = rng.normal(size=3)
+        R = Rot.from_rotvec(
+            axis / np.linalg.norm(axis) * np.deg2rad(rotation)).as_matrix()
+    direction = rng.normal(size=dim)
+    t = direction / np.linalg.norm(direction) * translation
+
+    current_points = R @ previous_points + t[:, np.newaxis]
+    current_points += rng.normal(0.0, noise, current_points.shape)
+
+    H_true = np.eye(dim + 1)
+    H_true[0:dim, 0:dim] = R.T
+    H_true[0:dim, dim] = -R.T @ t
+    return previous_points, current_points, H_true
+
+
+def transform_errors(H, H_true):
+    """
+    rotation error [deg] and translation error [m] of an estimate
+    """
+    dim = H.shape[0] - 1
+    dR = H[0:dim, 0:dim] @ H_true[0:dim, 0:dim].T
+    if dim == 2:
+        angle = math.atan2(dR[1, 0], dR[0, 0])
+    else:
+        angle = math.acos(np.clip((np.trace(dR) - 1.0) / 2.0, -1.0, 1.0))
+    return abs(np.rad2deg(angle)), float(
+        np.linalg.norm(H[0:dim, dim] - H_true[0:dim, dim]))
+
+
+def run_case(backend, previous_points, current_points, H_true):
+    """
+    Time a registration and measure its peak memory in a second run
+
+    tracemalloc slows down Python code, so the timed run is not traced.
+    A failing case is recorded with its status and error instead of
+    stopping the sweep.
+    """
+    record = {"status": "ok"}
+    try:
+        start = time.perf_counter()
+        result = BACKENDS[backend](previous_points, current_points)
+        record["wall_time"] = time.perf_counter() - start
+
+        tracemalloc.start()
+        try:
+            BACKENDS[backend](previous_points, current_points)
+            record["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    except MemoryError:
+        record["status"] = "out of memory"
+        return record
+    except Exception as e:  # e.g. LinAlgError on a degenerate case
+        record["status"] = "failed"
+        record["error"] = "{}: {}".format(type(e).__name__, e)
+        return record
+
+    if isinstance(result, tuple):  # open3d: (H, n_iter, converged)
+        H, record["n_iter"], record["converged"] = result
+        H = np.asarray(H)
+    else:
+        H = result.H
+        record["n_iter"] = result.n_iter
+        record["converged"] = bool(result.converged)
+    record["rotation_error"], record["translation_error"] = transform_errors(
+        H, H_true)
+    return record
+
+
+def run_benchmark(output, points=POINTS, dims=DIMS, noises=NOISES,
+                  misalignments=MISALIGNMENTS, backends=None, repeat=1,
+                  seed=0):
+    """
+    Run the sweep and append one JSON record per run to output
+
+    return: list of records
+    """
+    if backends is None:
+        backends = available_backends()
+
+    rng = np.random.default_rng(seed)
+    machine = platform.platform()
+    records = []
+    with open(output, "a") as f:
+        for n_points in points:
+            for dim in dims:
+                for noise in noises:
+                    for rotation, translation in misalignments:
+                        for trial in range(repeat):
+                            previous_points, current_points, H_true = simulate(
+                                n_points, dim, noise, rotation, translation,
+                                rng)
+                            for backend in backends:
+                                record = {
+                                    "backend": backend, "n_points": n_points,
+                                    "dim": dim, "noise": noise,
+                                    "rotation": rotation,
+                                    "translation": translation,
+                                    "trial": trial, "machine": machine}
+                                if backend == "brute" and \
+                                        n_points > BRUTE_MAX_POINTS:
+                                    record["status"] = "skipped"
+                                elif backend == "open3d" and dim != 3:
+                                    record["status"] = "skipped"
+                                else:
+                                    record.update(run_case(
+                                        backend, previous_points,
+                                        current_points, H_true))
+                                f.write(json.dumps(record) + "\n")
+                                f.flush()
+                                records.append(record)
+                                print_record(record)
+    return records
+
+
+def print_record(record):
+    if record["status"] != "ok":
+        print(record["backend"], record["n_points"], record["dim"],
+              record["status"], record.get("error", ""))
+        return
+    print("{backend:>15} N={n_points:<8} {dim}D noise={noise} "
+          "misalign={rotation}deg/{translation}m  {wall_time:8.3f} s "
+          "{peak_memory:>12} B  iter={n_iter}  "
+          "err={rotation_error:.4f}deg/{translation_error:.4f}m".format(
+              **record))
+
+
+def main():
+    print(__file__ + " start!!")
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-o", "--output", default="icp_benchmark.jsonl",
+                        help="JSON lines file the records are appended to")
+    parser.add_argument("--points", type=int, nargs="+", default=POINTS)
+    parser.add_argument("--dims", type=int, nargs="+", default=DIMS)
+    parser.add_argument("--noises", type=float, nargs="+", default=NOISES)
+    parser.add_argument("--rotations", type=float, nargs="+",
+                        help="rotation misalignments [deg], paired with "
+                             "--translations")
+    parser.add_argument("--translations", type=float, nargs="+",
+                        help="translation misalignments [m]")
+    parser.add_argument("--backends", nargs="+", choices=list(BACKENDS),
+                        help="default: every available backend")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    misalignments = MISALIGNMENTS
+    if args.rotations or args.translations:
+        if args.rotations is None or args.translations is None or \
+                len(args.rotations) != len(args.translations):
+            parser.error("--rotations and --translations must be paired")
+        misalignments = tuple(zip(args.rotations, args.translations))
+
+    run_benchmark(args.output, args.points, args.dims, args.noises,
+                  misalignments, args.backends, args.repeat, args.seed)
+
+
+if __name__ == '__main__':
+    main()
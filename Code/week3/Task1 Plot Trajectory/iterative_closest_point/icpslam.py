@@ -1,6 +1,18 @@
+import sys
+
 import open3d as o3d
 import numpy as np
 
+from iterative_closest_point import icp_registration
+from scan_stream import scan_stream
+from voxel_hash_map import VoxelHashMap
+
+# Map parameters
+VOXEL_SIZE = 0.05  # [m]
+MAX_POINTS_PER_VOXEL = 20
+MAX_AGE = 20  # frames a voxel stays in the map without observation, or None
+THRESHOLD = 0.1  # maximum correspondence distance [m]
+
 def generate_random_point_cloud():
     """Generate a random point cloud."""
     pc = o3d.geometry.PointCloud()
@@ -16,43 +28,51 @@ def apply_random_transformation(pc):
     transformation[:3, 3] = t
     return pc.transform(transformation)
 
-def draw_map(map_cloud):
+def simulated_scans(num_frames):
+    """Yield randomly transformed random point clouds as (3, N) arrays."""
+    for i in range(num_frames):
+        # Generate a new random point cloud and apply a random transformation
+        source = generate_random_point_cloud()
+        source = apply_random_transformation(source)
+        yield np.asarray(source.points).T
+
+def register_frame(local_map, points, pose):
+    """Align a frame to the map and insert it, return the new pose."""
+    if len(local_map) > 0:
+        # register against the voxel centroids, warm started at pose
+        map_points, association = local_map.index()
+        pose = icp_registration(map_points, points, nn_method=association,
+                                init_H=pose).H
+
+    local_map.insert(pose[:3, :3] @ points + pose[:3, 3:])
+    return pose
+
+def draw_map(local_map):
     """Visualize the accumulated map."""
+    map_cloud = o3d.geometry.PointCloud()
+    map_cloud.points = o3d.utility.Vector3dVector(local_map.all_points().T)
     o3d.visualization.draw_geometries([map_cloud], window_name="Accumulated Map")
 
-# Initialize an empty point cloud for the map
-map_cloud = o3d.geometry.PointCloud()
-
-# Generate and accumulate 10 frames of point clouds
-num_frames = 10
-threshold = 0.1
-trans_init = np.eye(4)
-
-for i in range(num_frames):
-    # Generate a new random point cloud and apply a random transformation
-    source = generate_random_point_cloud()
-    source = apply_random_transformation(source)
-    
-    # Color the source point cloud differently for each frame
-    color = np.random.rand(3)
-    source.paint_uniform_color(color)
-    
-    if i == 0:
-        # Initialize the map with the first point cloud
-        map_cloud += source
+def main(scan_dir=None):
+    # Incremental voxel map instead of an unbounded concatenated cloud
+    local_map = VoxelHashMap(VOXEL_SIZE, MAX_POINTS_PER_VOXEL, MAX_AGE,
+                             THRESHOLD)
+
+    if scan_dir is None:
+        # Generate and accumulate 10 frames of point clouds
+        scans = simulated_scans(10)
     else:
-        # Perform ICP to align the source to the map
-        reg_p2p = o3d.pipelines.registration.registration_icp(
-            source, map_cloud, threshold, trans_init,
-            o3d.pipelines.registration.TransformationEstimationPointToPoint()
-        )
-        
-        # Transform the source point cloud using the ICP result
-        source.transform(reg_p2p.transformation)
-        
-        # Accumulate the transformed source into the map
-        map_cloud += source
-
-# Visualize the accumulated ma
-
-draw_map(map_cloud)
+        # Stream recorded scans, the next ones load while one registers
+        scans = (points for _, points in scan_stream(scan_dir))
+
+    pose = np.eye(4)
+    for points in scans:
+        # Perform ICP to align the scan to the map and accumulate it
+        pose = register_frame(local_map, points, pose)
+
+    # Visualize the accumulated map
+    draw_map(local_map)
+
+if __name__ == '__main__':
+    # optional argument: directory of .npy/.pcd/.ply scans
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
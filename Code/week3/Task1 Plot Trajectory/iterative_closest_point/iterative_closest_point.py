@@ -3,88 +3,398 @@ Iterative Closest Point (ICP) SLAM example
 author: Atsushi Sakai (@Atsushi_twi), Göktuğ Karakaşlı, Shamil Gemuev
 """
 
+import concurrent.futures
 import math
+import os
+import time
+from collections import deque
+from multiprocessing import shared_memory
 
 from mpl_toolkits.mplot3d import Axes3D  # noqa: F401 unused import
 import matplotlib.pyplot as plt
 import numpy as np
+from scipy.spatial import cKDTree
+from scipy.spatial.transform import Rotation as Rot
 
 #  ICP parameters
 EPS = 0.0001
 MAX_ITER = 100
+NN_METHOD = "kdtree"  # nearest neighbor backend: "kdtree" or "brute"
+MOTION_METHOD = "svd"  # motion estimation: "svd", "point_to_plane", "gicp"
+NORMAL_K = 10  # number of neighbors for normal and covariance estimation
+GICP_EPSILON = 0.001  # covariance along the normal in generalized ICP
+PYRAMID_LEVELS = 3  # number of levels of the coarse-to-fine pyramid
+PYRAMID_COARSE_RATIO = 0.05  # coarsest voxel size / cloud diagonal
+PYRAMID_EPS_RATIO = 0.001  # coarse level eps / (voxel size * n points)
 
 show_animation = True
 
 
-def icp_matching(previous_points, current_points):
+class ICPResult:
     """
-    Iterative Closest Point matching
+    Result of an ICP registration
+
+    H: homogeneous transformation matrix mapping current to previous points
+    R: Rotation matrix
+    T: Translation vector
+    n_iter: number of iterations
+    residuals: residual error of every iteration
+    converged: True if the residual change fell below eps
+    """
+
+    def __init__(self, H, n_iter, residuals, converged):
+        self.H = H
+        self.R = H[0:-1, 0:-1]
+        self.T = H[0:-1, -1]
+        self.n_iter = n_iter
+        self.residuals = residuals
+        self.converged = converged
+
+    def __str__(self):
+        return "ICPResult(n_iter=" + str(self.n_iter) + ", converged=" + str(
+            self.converged) + ", residual=" + str(
+            self.residuals[-1] if len(self.residuals) else None) + ")"
+
+
+def icp_registration(previous_points, current_points, nn_method=None,
+                     motion_method=None, eps=EPS, max_iter=MAX_ITER,
+                     observer=None, init_H=None):
+    """
+    Iterative Closest Point registration without any plotting or printing
+
     - input
     previous_points: 2D or 3D points in the previous frame
-    current_points: 2D or 3D points in the current frame
+    current_points: 2D or 3D points in the current frame (not modified)
+    nn_method: nearest neighbor backend, see make_association
+    motion_method: motion estimation, see make_motion_estimation
+    eps: convergence threshold of the residual change
+    max_iter: maximum number of iterations
+    observer: optional callback observer(count, previous_points,
+        current_points, error) called after every iteration with the
+        transformed current points. The array is a work buffer, copy it
+        if it has to outlive the call.
+    init_H: initial homogeneous transformation matrix, default is identity
     - output
-    R: Rotation matrix
-    T: Translation vector
+    ICPResult
     """
-    H = None  # homogeneous transformation matrix
+    associate = make_association(previous_points, nn_method)
+    estimate = make_motion_estimation(previous_points, current_points,
+                                      motion_method, associate)
+    dim = previous_points.shape[0]
+    n_previous = previous_points.shape[1]
+
+    # work buffers, reused in every iteration
+    points = np.array(current_points, dtype=float)
+    moved = np.empty_like(points)
+    matched = np.empty_like(points)
+    H = np.eye(dim + 1)
+    if init_H is not None:
+        H[:] = init_H
+        np.matmul(H[0:dim, 0:dim], current_points, out=points)
+        points += H[0:dim, dim][:, np.newaxis]
+    H_step = np.eye(dim + 1)
+    H_tmp = np.empty_like(H)
+    residuals = np.empty(max_iter)
 
-    dError = np.inf
     preError = np.inf
+    converged = False
     count = 0
 
-    if show_animation:
-        fig = plt.figure()
-        if previous_points.shape[0] == 3:
-           fig.add_subplot(111, projection='3d')
-
-    while dError >= EPS:
+    while count < max_iter:
         count += 1
 
-        if show_animation:  # pragma: no cover
-            plot_points(previous_points, current_points, fig)
-            plt.pause(0.1)
+        indexes, error = associate(previous_points, points)
+        residuals[count - 1] = error
+        # associations may reject points with index n_previous
+        inliers = indexes < n_previous
+        if inliers.all():
+            np.take(previous_points, indexes, axis=1, out=matched)
+            Rt, Tt = estimate(matched, points, indexes, H[0:dim, 0:dim], None)
+        elif np.count_nonzero(inliers) > dim:
+            indexes = indexes[inliers]
+            Rt, Tt = estimate(previous_points[:, indexes], points[:, inliers],
+                              indexes, H[0:dim, 0:dim], inliers)
+        else:  # not enough correspondences left
+            break
 
-        indexes, error = nearest_neighbor_association(previous_points, current_points)
-        Rt, Tt = svd_motion_estimation(previous_points[:, indexes], current_points)
         # update current points
-        current_points = (Rt @ current_points) + Tt[:, np.newaxis]
+        np.matmul(Rt, points, out=moved)
+        moved += Tt[:, np.newaxis]
+        points, moved = moved, points
 
-        dError = preError - error
-        print("Residual:", error)
+        if observer is not None:
+            observer(count, previous_points, points, error)
 
+        dError = preError - error
         if dError < 0:  # prevent matrix H changing, exit loop
-            print("Not Converge...", preError, dError, count)
+            # a rise within eps is round-off of an already converged pair
+            converged = -dError <= eps
             break
 
         preError = error
-        H = update_homogeneous_matrix(H, Rt, Tt)
+        H_step[0:dim, 0:dim] = Rt
+        H_step[0:dim, dim] = Tt
+        np.matmul(H_step, H, out=H_tmp)
+        H, H_tmp = H_tmp, H
 
-        if dError <= EPS:
-            print("Converge", error, dError, count)
-            break
-        elif MAX_ITER <= count:
-            print("Not Converge...", error, dError, count)
+        if dError <= eps:
+            converged = True
             break
 
-    R = np.array(H[0:-1, 0:-1])
-    T = np.array(H[0:-1, -1])
+    return ICPResult(H, count, residuals[:count].copy(), converged)
+
+
+def icp_matching(previous_points, current_points, nn_method=None,
+                 motion_method=None, pyramid=None):
+    """
+    Iterative Closest Point matching
+    - input
+    previous_points: 2D or 3D points in the previous frame
+    current_points: 2D or 3D points in the current frame
+    nn_method: nearest neighbor backend, "kdtree", "brute" or a prebuilt
+        association object (e.g. KDTreeAssociation). Default is NN_METHOD.
+    motion_method: motion estimation, "svd", "point_to_plane" or "gicp".
+        Default is MOTION_METHOD.
+    pyramid: None for single scale ICP, True for a coarse-to-fine pyramid
+        with pyramid_voxel_sizes or a sequence of voxel sizes from coarse
+        to fine
+    - output
+    R: Rotation matrix
+    T: Translation vector
+    """
+    if show_animation:  # pragma: no cover
+        fig = plt.figure()
+        if previous_points.shape[0] == 3:
+            fig.add_subplot(111, projection='3d')
+        plot_points(previous_points, current_points, fig)
+        plt.pause(0.1)
+
+    def observer(count, previous_points, current_points, error):
+        print("Residual:", error)
+        if show_animation:  # pragma: no cover
+            plot_points(previous_points, current_points, fig)
+            plt.pause(0.1)
 
-    return R, T
+    if pyramid is None or pyramid is False:
+        result = icp_registration(previous_points, current_points,
+                                  nn_method=nn_method,
+                                  motion_method=motion_method,
+                                  observer=observer)
+    else:
+        result = pyramid_icp_registration(
+            previous_points, current_points,
+            voxel_sizes=None if pyramid is True else pyramid,
+            nn_method=nn_method, motion_method=motion_method,
+            observer=observer)
+
+    if result.converged:
+        print("Converge", result.residuals[-1], result.n_iter)
+    else:
+        print("Not Converge...", result.residuals[-1], result.n_iter)
 
+    return result.R, result.T
 
-def update_homogeneous_matrix(Hin, R, T):
 
-    r_size = R.shape[0]
-    H = np.zeros((r_size + 1, r_size + 1))
+def voxel_down_sample(points, voxel_size):
+    """
+    Replace the points in every voxel by their centroid
 
-    H[0:r_size, 0:r_size] = R
-    H[0:r_size, r_size] = T
-    H[r_size, r_size] = 1.0
+    points: (dim, N) points
+    voxel_size: voxel edge length [m], 0 or None returns points unchanged
+    return: (dim, M) centroids, M <= N
+    """
+    if not voxel_size:
+        return points
 
-    if Hin is None:
-        return H
-    else:
-        return Hin @ H
+    keys = np.floor(points / voxel_size).astype(np.int64)
+    keys -= keys.min(axis=1, keepdims=True)
+    flat_keys = np.ravel_multi_index(keys, keys.max(axis=1) + 1)
+    _, inverse, counts = np.unique(flat_keys, return_inverse=True,
+                                   return_counts=True)
+
+    down = np.empty((points.shape[0], counts.shape[0]))
+    for i in range(points.shape[0]):
+        down[i] = np.bincount(inverse, weights=points[i]) / counts
+
+    return down
+
+
+def pyramid_voxel_sizes(points, levels=PYRAMID_LEVELS):
+    """
+    Voxel sizes of a coarse-to-fine pyramid for the given cloud
+
+    The coarsest voxel is PYRAMID_COARSE_RATIO of the bounding box
+    diagonal and every finer level halves it. The last level is the full
+    resolution cloud (voxel size 0).
+    """
+    extent = np.linalg.norm(points.max(axis=1) - points.min(axis=1))
+    coarse = extent * PYRAMID_COARSE_RATIO
+    return tuple(coarse / 2 ** i for i in range(levels - 1)) + (0.0,)
+
+
+def pyramid_icp_registration(previous_points, current_points,
+                             voxel_sizes=None, init_H=None, observer=None,
+                             **kwargs):
+    """
+    Coarse-to-fine ICP on a voxel down sampled pyramid
+
+    Every level is solved with icp_registration and warm-starts the next
+    finer level, so the full resolution level only needs a few iterations
+    to refine an almost aligned pair.
+
+    - input
+    previous_points: 2D or 3D points in the previous frame
+    current_points: 2D or 3D points in the current frame
+    voxel_sizes: voxel size of every level from coarse to fine, 0 means
+        full resolution. Default is pyramid_voxel_sizes(previous_points).
+    init_H: initial homogeneous transformation matrix
+    observer: see icp_registration, receives the points of every level
+    kwargs: forwarded to icp_registration (nn_method, motion_method, eps,
+        max_iter). A prebuilt association object as nn_method indexes the
+        full resolution previous_points, so it is only used on the full
+        resolution level and the coarse levels build their own.
+    - output
+    ICPResult, n_iter and residuals are summed up over all levels and
+    converged refers to the finest level
+    """
+    if voxel_sizes is None:
+        voxel_sizes = pyramid_voxel_sizes(previous_points)
+    prebuilt = not isinstance(kwargs.get("nn_method"), (str, type(None)))
+    if prebuilt and voxel_sizes[-1]:
+        raise ValueError("A prebuilt association needs a full resolution "
+                         "(voxel size 0) finest pyramid level")
+
+    eps = kwargs.pop("eps", EPS)
+    H = init_H
+    n_iter = 0
+    residuals = []
+    result = None
+    for voxel_size in voxel_sizes:
+        previous_level = voxel_down_sample(previous_points, voxel_size)
+        current_level = voxel_down_sample(current_points, voxel_size)
+        # a coarse level only has to be accurate to a fraction of its voxel
+        level_eps = max(eps, PYRAMID_EPS_RATIO * voxel_size *
+                        current_level.shape[1])
+        level_kwargs = kwargs
+        if prebuilt and voxel_size:
+            level_kwargs = dict(kwargs, nn_method=None)
+        result = icp_registration(previous_level, current_level,
+                                  eps=level_eps, init_H=H, observer=observer,
+                                  **level_kwargs)
+        H = result.H
+        n_iter += result.n_iter
+        residuals.append(result.residuals)
+
+    return ICPResult(H, n_iter, np.concatenate(residuals), result.converged)
+
+
+class BatchReport:
+    """
+    Throughput of a batch_icp_registration run, updated while it streams
+    """
+
+    def __init__(self):
+        self.n_pairs = 0
+        self.elapsed = 0.0  # [s]
+
+    @property
+    def pairs_per_second(self):
+        if self.elapsed <= 0.0:
+            return 0.0
+        return self.n_pairs / self.elapsed
+
+    def __str__(self):
+        return str(self.n_pairs) + " pairs in " + str(
+            round(self.elapsed, 3)) + " s (" + str(
+            round(self.pairs_per_second, 1)) + " pairs/s)"
+
+
+def _to_shared_memory(points):
+    points = np.asarray(points, dtype=float)
+    shm = shared_memory.SharedMemory(create=True, size=max(points.nbytes, 1))
+    buffer = np.ndarray(points.shape, dtype=float, buffer=shm.buf)
+    buffer[:] = points
+    del buffer
+    return shm, (shm.name, points.shape)
+
+
+def _batch_worker(previous_desc, current_desc, kwargs):
+    shms = [shared_memory.SharedMemory(name=name)
+            for name, _ in (previous_desc, current_desc)]
+    try:
+        previous_points = np.ndarray(previous_desc[1], dtype=float,
+                                     buffer=shms[0].buf)
+        current_points = np.ndarray(current_desc[1], dtype=float,
+                                    buffer=shms[1].buf)
+        result = icp_registration(previous_points, current_points, **kwargs)
+        del previous_points, current_points
+    finally:
+        for shm in shms:
+            shm.close()
+    return result
+
+
+def batch_icp_registration(pairs, max_workers=None, max_pending=None,
+                           report=None, **kwargs):
+    """
+    Register many (previous_points, current_points) pairs over a process pool
+
+    - input
+    pairs: list or generator of (previous_points, current_points) arrays
+    max_workers: number of worker processes, default is the CPU count
+    max_pending: maximum number of pairs in flight, default 2 * max_workers.
+        The pairs generator is only consumed this far ahead.
+    report: optional BatchReport, updated after every finished pair
+    kwargs: forwarded to icp_registration (nn_method, eps, max_iter)
+    - output
+    generator of ICPResult, in the same order as pairs
+
+    Point arrays are copied once into shared memory blocks that the workers
+    map directly, so only the block names go through the pickled task.
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if max_pending is None:
+        max_pending = 2 * max_workers
+    if report is None:
+        report = BatchReport()
+
+    pairs = iter(pairs)
+    pending = deque()
+    start = time.perf_counter()
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+        try:
+            while True:
+                while len(pending) < max_pending:
+                    pair = next(pairs, None)
+                    if pair is None:
+                        break
+                    blocks = [_to_shared_memory(points) for points in pair]
+                    future = executor.submit(_batch_worker, blocks[0][1],
+                                             blocks[1][1], kwargs)
+                    pending.append((future, [shm for shm, _ in blocks]))
+
+                if not pending:
+                    break
+
+                future, shms = pending.popleft()
+                try:
+                    result = future.result()
+                finally:
+                    for shm in shms:
+                        shm.close()
+                        shm.unlink()
+
+                report.n_pairs += 1
+                report.elapsed = time.perf_counter() - start
+                yield result
+        finally:
+            for future, shms in pending:
+                future.cancel()
+                for shm in shms:
+                    shm.close()
+                    shm.unlink()
 
 
 def nearest_neighbor_association(previous_points, current_points):
@@ -102,6 +412,61 @@ def nearest_neighbor_association(previous_points, current_points):
     return indexes, error
 
 
+class KDTreeAssociation:
+    """
+    Nearest neighbor association backed by a KD-tree
+
+    The tree is built once on previous_points and reused for every query,
+    so each ICP iteration costs O(M log N) time and O(M) memory instead of
+    the O(N*M) distance matrix of nearest_neighbor_association.
+    Works for 2D and 3D points.
+
+    With max_distance, points without a neighbor closer than max_distance
+    are rejected: their index is n_points and they add max_distance to the
+    residual. This keeps partially overlapping clouds from being pulled
+    together by points that have no counterpart.
+    """
+
+    def __init__(self, previous_points, max_distance=None):
+        self.n_points = previous_points.shape[1]
+        self.max_distance = max_distance
+        self.tree = cKDTree(np.ascontiguousarray(previous_points.T))
+
+    def __call__(self, previous_points, current_points):
+        # the residual is the sum of nearest neighbor distances, so the
+        # two clouds do not need the same number of points
+        if self.max_distance is None:
+            d, indexes = self.tree.query(current_points.T)
+        else:
+            d, indexes = self.tree.query(current_points.T,
+                                         distance_upper_bound=self.max_distance)
+            d[indexes == self.n_points] = self.max_distance
+        error = np.sum(d)
+
+        return indexes, error
+
+
+def make_association(previous_points, nn_method=None):
+    """
+    Select the nearest neighbor association used by icp_matching
+
+    nn_method: "kdtree", "brute", None (use NN_METHOD) or an association
+        object that is called as f(previous_points, current_points) and
+        returns (indexes, error).
+    """
+    if nn_method is None:
+        nn_method = NN_METHOD
+
+    if callable(nn_method):
+        return nn_method
+    elif nn_method == "kdtree":
+        return KDTreeAssociation(previous_points)
+    elif nn_method == "brute":
+        return nearest_neighbor_association
+    else:
+        raise ValueError("Unknown nearest neighbor method: " + str(nn_method))
+
+
 def svd_motion_estimation(previous_points, current_points):
     pm = np.mean(previous_points, axis=1)
     cm = np.mean(current_points, axis=1)
@@ -118,6 +483,193 @@ def svd_motion_estimation(previous_points, current_points):
     return R, t
 
 
+def estimate_covariances(points, k=NORMAL_K, tree=None):
+    """
+    Local covariance of every point from its k nearest neighbors
+
+    points: (dim, N) points
+    tree: optional cKDTree already built on points
+    return: (N, dim, dim) covariance matrices
+    """
+    k = min(k, points.shape[1])
+    pts = np.ascontiguousarray(points.T)
+    if tree is None:
+        tree = cKDTree(pts)
+    _, indexes = tree.query(pts, k)
+    neighbors = pts[indexes]  # (N, k, dim)
+    neighbors -= neighbors.mean(axis=1, keepdims=True)
+    return np.matmul(neighbors.transpose(0, 2, 1), neighbors) / k
+
+
+def estimate_normals(points, k=NORMAL_K, tree=None):
+    """
+    Surface normal of every point from its k nearest neighbors
+
+    The normal is the eigenvector of the smallest eigenvalue of the local
+    covariance, a line normal in 2D and a plane normal in 3D.
+
+    points: (dim, N) points
+    tree: optional cKDTree already built on points
+    return: (dim, N) unit normals
+    """
+    _, v = np.linalg.eigh(estimate_covariances(points, k, tree))
+    return np.ascontiguousarray(v[:, :, 0].T)
+
+
+def plane_covariances(points, k=NORMAL_K, epsilon=GICP_EPSILON, tree=None):
+    """
+    Plane-to-plane covariances of generalized ICP
+
+    The local covariances are regularized to eigenvalues (epsilon, 1, 1),
+    i.e. each point is modeled as a small disc on its local surface.
+
+    return: (N, dim, dim) covariance matrices
+    """
+    _, v = np.linalg.eigh(estimate_covariances(points, k, tree))
+    scale = np.ones(points.shape[0])
+    scale[0] = epsilon
+    return np.matmul(v * scale, v.transpose(0, 2, 1))
+
+
+def rotation_from_vector(w):
+    """
+    Rotation matrix of a rotation angle [w] (2D) or rotation vector (3D)
+    """
+    if w.shape[0] == 1:
+        c, s = math.cos(w[0]), math.sin(w[0])
+        return np.array([[c, -s], [s, c]])
+    return Rot.from_rotvec(w).as_matrix()
+
+
+def rotation_jacobian(points):
+    """
+    Derivative of R @ points with respect to a small rotation at R = I
+
+    return: (N, dim, n_rot), n_rot is 1 in 2D and 3 in 3D
+    """
+    if points.shape[0] == 2:
+        return np.stack((-points[1], points[0]), axis=1)[:, :, np.newaxis]
+    x, y, z = points
+    zero = np.zeros_like(x)
+    # -[p]x, the derivative of w x p with respect to w
+    return np.stack((np.stack((zero, z, -y), axis=1),
+                     np.stack((-z, zero, x), axis=1),
+                     np.stack((y, -x, zero), axis=1)), axis=1)
+
+
+def point_to_plane_motion_estimation(previous_points, current_points,
+                                     previous_normals):
+    """
+    One Gauss-Newton step of point-to-plane ICP
+
+    Minimizes sum(n_i . (R c_i + t - p_i))^2 linearized around R = I, t = 0.
+
+    previous_points: (dim, N) matched points of the previous frame
+    current_points: (dim, N) points of the current frame
+    previous_normals: (dim, N) normals of the matched previous points
+    return: R, t
+    """
+    dim = current_points.shape[0]
+    if dim == 2:
+        # d(R c)/dtheta . n
+        J_rot = (current_points[0] * previous_normals[1] -
+                 current_points[1] * previous_normals[0])[:, np.newaxis]
+    else:
+        # d(R c)/dw . n = c x n
+        J_rot = np.cross(current_points.T, previous_normals.T)
+    J = np.hstack((J_rot, previous_normals.T))  # (N, n_rot + dim)
+    r = np.einsum('in,in->n', previous_normals,
+                  current_points - previous_points)
+
+    x = np.linalg.solve(J.T @ J, -(J.T @ r))
+    n_rot = J.shape[1] - dim
+
+    return rotation_from_vector(x[:n_rot]), x[n_rot:]
+
+
+def gicp_motion_estimation(previous_points, current_points,
+                           previous_covariances, current_covariances):
+    """
+    One Gauss-Newton step of generalized (plane-to-plane) ICP
+
+    Minimizes sum d_i^T (C_p + C_c)^-1 d_i with d_i = p_i - (R c_i + t),
+    linearized around R = I, t = 0.
+
+    previous_points: (dim, N) matched points of the previous frame
+    current_points: (dim, N) points of the current frame
+    previous_covariances: (N, dim, dim) covariances of the matched points
+    current_covariances: (N, dim, dim) covariances of the current points,
+        already rotated into the current estimate
+    return: R, t
+    """
+    dim = current_points.shape[0]
+    n = current_points.shape[1]
+    M = np.linalg.inv(previous_covariances + current_covariances)
+
+    J = np.concatenate((-rotation_jacobian(current_points),
+                        np.broadcast_to(-np.eye(dim), (n, dim, dim))), axis=2)
+    d = (previous_points - current_points).T  # (N, dim)
+
+    JtM = np.matmul(J.transpose(0, 2, 1), M)
+    A = np.matmul(JtM, J).sum(axis=0)
+    b = np.matmul(JtM, d[:, :, np.newaxis]).sum(axis=0)[:, 0]
+    x = np.linalg.solve(A, -b)
+    n_rot = J.shape[2] - dim
+
+    return rotation_from_vector(x[:n_rot]), x[n_rot:]
+
+
+def make_motion_estimation(previous_points, current_points,
+                           motion_method=None, associate=None):
+    """
+    Select the motion estimation used by icp_registration
+
+    motion_method: "svd" (point-to-point), "point_to_plane", "gicp" or None
+        (use MOTION_METHOD). Normals and covariances are computed once per
+        cloud here and looked up by index in every iteration. They pay off
+        on structured scenes. On unstructured clouds such as the
+        main_3d_points simulation, estimating them costs more time than
+        the saved iterations, so "svd" stays the default.
+    associate: optional association object, its KD-tree is reused for the
+        normal estimation of previous_points
+    return: estimate(matched_points, points, indexes, R, inliers) ->
+        (Rt, Tt), where R is the rotation already applied to points and
+        inliers is None or the mask of the current points that points,
+        matched_points and indexes were selected with
+    """
+    if motion_method is None:
+        motion_method = MOTION_METHOD
+
+    # reuse the KD-tree of the association if it is built on the same cloud
+    tree = getattr(associate, "tree", None)
+
+    if motion_method == "svd":
+        def estimate(matched_points, points, indexes, R, inliers):
+            return svd_motion_estimation(matched_points, points)
+    elif motion_method == "point_to_plane":
+        previous_normals = estimate_normals(previous_points, tree=tree)
+
+        def estimate(matched_points, points, indexes, R, inliers):
+            return point_to_plane_motion_estimation(
+                matched_points, points, previous_normals[:, indexes])
+    elif motion_method == "gicp":
+        previous_covariances = plane_covariances(previous_points, tree=tree)
+        current_covariances = plane_covariances(current_points)
+
+        def estimate(matched_points, points, indexes, R, inliers):
+            covariances = current_covariances
+            if inliers is not None:
+                covariances = covariances[inliers]
+            return gicp_motion_estimation(
+                matched_points, points, previous_covariances[indexes],
+                R @ covariances @ R.T)
+    else:
+        raise ValueError("Unknown motion estimation method: " +
+                         str(motion_method))
+
+    return estimate
+
+
 def plot_points(previous_points, current_points, figure):
     # for stopping simulation with the esc key.
     plt.gcf().canvas.mpl_connect(
@@ -200,6 +752,33 @@ def main_3d_points():
         print("T:", T)
 
 
+def main_batch():
+    print(__file__ + " start!!")
+
+    # simulation parameters for a batch of 2d point set pairs
+    nPoint = 1000
+    fieldLength = 50.0
+    nPair = 200
+    motion = [0.5, 2.0, np.deg2rad(-10.0)]  # movement [x[m],y[m],yaw[deg]]
+
+    c, s = math.cos(motion[2]), math.sin(motion[2])
+    Rm = np.array([[c, -s], [s, c]])
+
+    def generate_pairs():
+        for _ in range(nPair):
+            previous_points = (np.random.rand(2, nPoint) - 0.5) * fieldLength
+            current_points = Rm @ previous_points + np.array(
+                motion[0:2])[:, np.newaxis]
+            yield previous_points, current_points
+
+    report = BatchReport()
+    for result in batch_icp_registration(generate_pairs(), report=report):
+        pass
+    print("last T:", result.T)
+    print("Batch:", report)
+
+
 if __name__ == '__main__':
     main()
     main_3d_points()
+    main_batch()
@@ -0,0 +1,258 @@
+"""
+Normal Distributions Transform (NDT) scan matching
+
+The target cloud is summarized once by a Gaussian (mean and inverse
+covariance) per voxel. A source scan is aligned by maximizing the sum of the
+Gaussian likelihoods of its points, so no nearest neighbor search is needed
+and one NDTTarget can be reused for many source scans.
+
+ref:
+- Biber, P. and Strasser, W. The normal distributions transform: a new
+  approach to laser scan matching. IROS 2003.
+- Magnusson, M. The three-dimensional normal-distributions transform.
+  PhD thesis, Orebro University, 2009.
+"""
+
+import math
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from iterative_closest_point import (ICPResult, MAX_ITER, plot_points,
+                                     rotation_from_vector, rotation_jacobian)
+from voxel_hash_map import voxel_keys
+
+#  NDT parameters
+NDT_VOXEL_SIZE = 5.0  # [m]
+NDT_PYRAMID = (10.0, 5.0, 2.0)  # voxel sizes of make_ndt_pyramid [m]
+NDT_MIN_POINTS = 5  # minimum number of points of a voxel Gaussian
+NDT_EIGEN_RATIO = 0.01  # minimum / maximum covariance eigenvalue
+NDT_EPS = 1e-5  # convergence threshold of the update step
+NDT_COST_EPS = 1e-4  # convergence threshold of the cost change per point
+
+show_animation = True
+
+
+class NDTTarget:
+
+    def __init__(self, points, voxel_size=NDT_VOXEL_SIZE,
+                 min_points=NDT_MIN_POINTS):
+        """
+        Per voxel Gaussians of a target cloud
+
+        points: (dim, N) target points
+        voxel_size: voxel edge length [m]
+        min_points: voxels with fewer points are dropped
+        """
+        self.voxel_size = voxel_size
+        self.dim = points.shape[0]
+
+        keys, inverse, counts = np.unique(voxel_keys(points, voxel_size),
+                                          return_inverse=True,
+                                          return_counts=True)
+        pts = points.T
+        sums = np.zeros((keys.shape[0], self.dim))
+        np.add.at(sums, inverse, pts)
+        means = sums / counts[:, np.newaxis]
+        shift = pts - means[inverse]
+        covariances = np.zeros((keys.shape[0], self.dim, self.dim))
+        np.add.at(covariances, inverse, shift[:, :, np.newaxis] *
+                  shift[:, np.newaxis, :])
+        covariances /= np.maximum(counts - 1, 1)[:, np.newaxis, np.newaxis]
+
+        valid = counts >= min_points
+        w, v = np.linalg.eigh(covariances[valid])
+        # inflate flat or degenerate distributions (Magnusson 2009, 6.2)
+        w = np.maximum(w, NDT_EIGEN_RATIO * w[:, -1:])
+        w = np.maximum(w, 1e-9)
+
+        self.keys = keys[valid]  # sorted
+        self.means = means[valid]
+        self.inv_covariances = np.matmul(v / w[:, np.newaxis, :],
+                                         v.transpose(0, 2, 1))
+
+    def __len__(self):
+        return self.keys.shape[0]
+
+    def lookup(self, points):
+        """
+        Index of the voxel Gaussian of every point, -1 for empty voxels
+
+        points: (dim, N) points
+        """
+        keys = voxel_keys(points, self.voxel_size)
+        indexes = np.searchsorted(self.keys, keys)
+        indexes[indexes == self.keys.shape[0]] = 0
+        indexes[self.keys[indexes] != keys] = -1
+        return indexes
+
+
+def ndt_score(target, points):
+    """
+    NDT cost of points in target, sum of (1 - likelihood) per point
+
+    return: cost, matched (N,) mask of the points inside a voxel, voxel
+        indexes of the matched points (M,), offsets q (M, dim) from the
+        voxel means, inverse covariances times q Cq (M, dim), weights (M,)
+    """
+    indexes = target.lookup(points)
+    matched = indexes >= 0
+    voxels = indexes[matched]
+
+    q = points.T[matched] - target.means[voxels]
+    Cq = np.matmul(target.inv_covariances[voxels], q[:, :, np.newaxis])[:, :, 0]
+    weights = np.exp(-0.5 * np.einsum('ni,ni->n', q, Cq))
+    cost = points.shape[1] - np.sum(weights)
+
+    return cost, matched, voxels, q, Cq, weights
+
+
+def make_ndt_pyramid(points, voxel_sizes=NDT_PYRAMID):
+    """
+    NDTTargets of a cloud from coarse to fine for ndt_registration
+    """
+    return [NDTTarget(points, voxel_size) for voxel_size in voxel_sizes]
+
+
+def ndt_registration(target, current_points, init_H=None, max_iter=MAX_ITER,
+                     eps=NDT_EPS, observer=None):
+    """
+    Align current_points to an NDT target
+
+    - input
+    target: NDTTarget, a list of NDTTargets from coarse to fine (see
+        make_ndt_pyramid) where each level warm-starts the next one, or
+        (dim, N) target points to build an NDTTarget from
+    current_points: 2D or 3D points of the scan (not modified)
+    init_H: initial homogeneous transformation matrix, default is identity
+    max_iter: maximum number of iterations
+    eps: convergence threshold of the update step
+    observer: optional callback observer(count, target_means,
+        current_points, cost), see icp_registration
+    - output
+    ICPResult, residuals holds the NDT cost of every iteration
+    """
+    if isinstance(target, (list, tuple)):
+        n_iter = 0
+        residuals = []
+        for level in target:
+            result = ndt_registration(level, current_points, init_H=init_H,
+                                      max_iter=max_iter, eps=eps,
+                                      observer=observer)
+            init_H = result.H
+            n_iter += result.n_iter
+            residuals.append(result.residuals)
+        return ICPResult(result.H, n_iter, np.concatenate(residuals),
+                         result.converged)
+
+    if not isinstance(target, NDTTarget):
+        target = NDTTarget(target)
+    dim = current_points.shape[0]
+    n_rot = 1 if dim == 2 else 3
+
+    H = np.eye(dim + 1)
+    if init_H is not None:
+        H[:] = init_H
+    H_step = np.eye(dim + 1)
+    residuals = np.empty(max_iter)
+    points = H[0:dim, 0:dim] @ current_points + H[0:dim, dim][:, np.newaxis]
+
+    cost_eps = NDT_COST_EPS * current_points.shape[1]
+    preCost = np.inf
+    converged = False
+    count = 0
+
+    while count < max_iter:
+        count += 1
+
+        cost, matched, voxels, q, Cq, weights = ndt_score(target, points)
+        residuals[count - 1] = cost
+        dCost = preCost - cost
+        if dCost < 0:  # the last step was worse, undo it and stop
+            H = H_prev
+            converged = -dCost <= cost_eps
+            break
+        elif dCost <= cost_eps:
+            converged = True
+            break
+        preCost = cost
+
+        # Gauss-Newton step of the weighted Mahalanobis distances
+        n = q.shape[0]
+        if n <= dim:
+            break
+        J = np.concatenate((rotation_jacobian(points[:, matched]),
+                            np.broadcast_to(np.eye(dim), (n, dim, dim))),
+                           axis=2)
+        JtC = np.matmul(J.transpose(0, 2, 1),
+                        target.inv_covariances[voxels])
+        JtC *= weights[:, np.newaxis, np.newaxis]
+        A = np.matmul(JtC, J).sum(axis=0)
+        b = np.einsum('nja,nj->a', J, Cq * weights[:, np.newaxis])
+        x = np.linalg.solve(A, -b)
+
+        Rt = rotation_from_vector(x[:n_rot])
+        Tt = x[n_rot:]
+        points = Rt @ points + Tt[:, np.newaxis]
+
+        H_step[0:dim, 0:dim] = Rt
+        H_step[0:dim, dim] = Tt
+        H_prev = H
+        H = H_step @ H
+
+        if observer is not None:
+            observer(count, target.means.T, points, cost)
+
+        if np.max(np.abs(x)) < eps:
+            converged = True
+            break
+
+    return ICPResult(H, count, residuals[:count].copy(), converged)
+
+
+def main():
+    print(__file__ + " start!!")
+
+    # simulation parameters for a 3d scene of point clusters
+    nCluster = 1000
+    nPointPerCluster = 20
+    fieldLength = 50.0
+    motion = [0.5, 2.0, -1.0, np.deg2rad(-10.0)]  # [x[m],y[m],z[m],roll[deg]]
+
+    nsim = 3  # number of simulation
+
+    centers = (np.random.rand(3, nCluster) - 0.5) * fieldLength
+    previous_points = np.repeat(centers, nPointPerCluster, axis=1)
+    previous_points += np.random.randn(*previous_points.shape) * 0.3
+
+    # the target is summarized once and reused for every scan
+    target = make_ndt_pyramid(previous_points)
+    print("voxels per level:", [len(level) for level in target])
+
+    c, s = math.cos(motion[3]), math.sin(motion[3])
+    Rm = np.array([[c, 0.0, -s], [0.0, 1.0, 0.0], [s, 0.0, c]])
+
+    for _ in range(nsim):
+        # current points: the target seen from a moved sensor with noise
+        current_points = Rm @ previous_points + np.array(
+            motion[0:3])[:, np.newaxis]
+        current_points += np.random.randn(*current_points.shape) * 0.05
+
+        if show_animation:  # pragma: no cover
+            fig = plt.figure()
+            fig.add_subplot(111, projection='3d')
+
+            def observer(count, means, points, cost):
+                plot_points(means, points, fig)
+                plt.pause(0.1)
+        else:
+            observer = None
+
+        result = ndt_registration(target, current_points, observer=observer)
+        print(result)
+        print("R:", result.R)
+        print("T:", result.T)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,420 @@
+"""
+Keyframe based pose graph SLAM on top of ICP
+
+Frames are tracked against the last keyframe with icp_registration. A frame
+becomes a keyframe when it moved more than a translation or rotation
+threshold, and adds an odometry edge to the pose graph. Loop closure
+candidates are looked up in a voxel hashed spatial index over the keyframe
+positions, verified with ICP and added as loop edges.
+
+The graph is optimized with Gauss-Newton on SE(3) and a sparse solver. The
+optimization is incremental: odometry-only keyframes are placed by
+composition without solving, and a loop closure only re-linearizes the
+edges around the nodes it moves, the blocks of all other edges are kept.
+"""
+
+import math
+
+import matplotlib.pyplot as plt
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.linalg import spsolve
+from scipy.spatial.transform import Rotation as Rot
+
+from iterative_closest_point import (KDTreeAssociation, icp_registration,
+                                     voxel_down_sample)
+
+# Keyframe parameters
+KEYFRAME_DISTANCE = 1.0  # [m]
+KEYFRAME_ANGLE = np.deg2rad(10.0)  # [rad]
+KEYFRAME_VOXEL_SIZE = 0.2  # down sampling of the stored keyframe clouds [m]
+MAX_CORRESPONDENCE_DISTANCE = 0.5  # [m]
+
+# Loop closure parameters
+LOOP_RADIUS = 3.0  # search radius around a new keyframe [m]
+LOOP_MIN_GAP = 10  # minimum keyframe index difference of a loop
+LOOP_MAX_RESIDUAL = 0.1  # maximum mean ICP residual of a loop [m]
+
+# Optimization parameters
+OPT_MAX_ITER = 10
+OPT_RELINEARIZE_THRESHOLD = 1e-4  # increment that re-linearizes a node
+
+show_animation = True
+
+
+def invert_poses(T):
+    """
+    Inverse of (..., 4, 4) homogeneous transformation matrices
+    """
+    R_inv = np.swapaxes(T[..., 0:3, 0:3], -1, -2)
+    T_inv = np.zeros_like(T)
+    T_inv[..., 0:3, 0:3] = R_inv
+    T_inv[..., 0:3, 3] = -np.einsum('...ij,...j->...i', R_inv, T[..., 0:3, 3])
+    T_inv[..., 3, 3] = 1.0
+    return T_inv
+
+
+def pose_error(T):
+    """
+    6D error [translation, rotation vector] of (..., 4, 4) relative poses
+    """
+    shape = T.shape[:-2]
+    rotvec = Rot.from_matrix(T[..., 0:3, 0:3].reshape(-1, 3, 3)).as_rotvec()
+    return np.concatenate((T[..., 0:3, 3], rotvec.reshape(shape + (3,))),
+                          axis=-1)
+
+
+def pose_exp(delta):
+    """
+    (..., 4, 4) transformation matrices of (..., 6) increments
+    [translation, rotation vector]
+    """
+    shape = delta.shape[:-1]
+    T = np.zeros(shape + (4, 4))
+    T[..., 0:3, 0:3] = Rot.from_rotvec(
+        delta[..., 3:6].reshape(-1, 3)).as_matrix().reshape(shape + (3, 3))
+    T[..., 0:3, 3] = delta[..., 0:3]
+    T[..., 3, 3] = 1.0
+    return T
+
+
+def adjoint(T):
+    """
+    (..., 6, 6) adjoint of (..., 4, 4) transformation matrices for
+    increments ordered [translation, rotation]
+    """
+    R = T[..., 0:3, 0:3]
+    x, y, z = np.moveaxis(T[..., 0:3, 3], -1, 0)
+    zero = np.zeros_like(x)
+    t_hat = np.stack((np.stack((zero, -z, y), axis=-1),
+                      np.stack((z, zero, -x), axis=-1),
+                      np.stack((-y, x, zero), axis=-1)), axis=-2)
+    adj = np.zeros(T.shape[:-2] + (6, 6))
+    adj[..., 0:3, 0:3] = R
+    adj[..., 0:3, 3:6] = t_hat @ R
+    adj[..., 3:6, 3:6] = R
+    return adj
+
+
+class PoseGraph:
+    """
+    Pose graph with incremental Gauss-Newton optimization
+
+    Every edge keeps its linearization: the Hessian and gradient blocks at
+    the linearization poses of its nodes. The estimate is the linearization
+    pose of every node composed with the increment of the last solve, and
+    only the nodes whose increment exceeds a threshold are re-linearized
+    together with their edges, see M. Kaess et al., "iSAM2: Incremental
+    smoothing and mapping using the Bayes tree", IJRR, 2012. Nodes and
+    edges are stored in buffers that double when full.
+    """
+
+    def __init__(self, capacity=64):
+        self.n_nodes = 0
+        self.n_edges = 0
+        self._poses = np.zeros((capacity, 4, 4))  # current estimates
+        self._linearization = np.zeros((capacity, 4, 4))
+        self._edge_i = np.zeros(capacity, dtype=np.int64)
+        self._edge_j = np.zeros(capacity, dtype=np.int64)
+        self._measurements = np.zeros((capacity, 4, 4))  # pose of j in i
+        self._information = np.zeros((capacity, 6, 6))
+        self._stale = np.zeros(capacity, dtype=bool)  # linearization outdated
+        # Hessian blocks ii, ij, ji, jj, their sparse indexes, and gradient
+        # blocks i, j of every edge
+        self._blocks = np.zeros((capacity, 4, 6, 6))
+        self._rows = np.zeros((capacity, 4, 6, 6), dtype=np.int64)
+        self._cols = np.zeros((capacity, 4, 6, 6), dtype=np.int64)
+        self._gradients = np.zeros((capacity, 2, 6))
+
+    def __len__(self):
+        return self.n_nodes
+
+    @property
+    def poses(self):
+        return self._poses[:self.n_nodes]
+
+    @property
+    def edge_i(self):
+        return self._edge_i[:self.n_edges]
+
+    @property
+    def edge_j(self):
+        return self._edge_j[:self.n_edges]
+
+    @property
+    def measurements(self):
+        return self._measurements[:self.n_edges]
+
+    @property
+    def information(self):
+        return self._information[:self.n_edges]
+
+    def add_node(self, pose):
+        if self.n_nodes == self._poses.shape[0]:
+            self._grow(("_poses", "_linearization"))
+        self._poses[self.n_nodes] = pose
+        self._linearization[self.n_nodes] = pose
+        self.n_nodes += 1
+        return self.n_nodes - 1
+
+    def add_edge(self, i, j, measurement, information):
+        """
+        i, j: node indexes
+        measurement: 4x4 pose of node j in the frame of node i
+        information: 6x6 information matrix of [translation, rotation]
+        """
+        if self.n_edges == self._edge_i.shape[0]:
+            self._grow(("_edge_i", "_edge_j", "_measurements",
+                        "_information", "_stale", "_blocks", "_rows",
+                        "_cols", "_gradients"))
+        k = self.n_edges
+        self._edge_i[k] = i
+        self._edge_j[k] = j
+        self._measurements[k] = measurement
+        self._information[k] = information
+        self._stale[k] = True
+        r = np.arange(6)
+        for block, (a, b) in enumerate(((i, i), (i, j), (j, i), (j, j))):
+            self._rows[k, block] = 6 * a + r[:, None]
+            self._cols[k, block] = 6 * b + r[None, :]
+        self.n_edges += 1
+
+    def optimize(self, max_iter=OPT_MAX_ITER,
+                 threshold=OPT_RELINEARIZE_THRESHOLD):
+        """
+        Gauss-Newton optimization warm-started at the current linearization
+
+        The first node is held fixed. New edges and the edges of nodes that
+        moved by more than threshold since their linearization are
+        re-linearized, the blocks of all other edges are reused.
+        return: number of iterations
+        """
+        n = self.n_nodes
+        count = 0
+        while count < max_iter:
+            count += 1
+            stale = np.flatnonzero(self._stale[:self.n_edges])
+            if stale.shape[0]:
+                self._linearize(stale)
+            delta = self._solve().reshape(n, 6)
+            self._poses[:n] = self._linearization[:n] @ pose_exp(delta)
+
+            moved = np.flatnonzero(np.max(np.abs(delta), axis=1) > threshold)
+            if not moved.shape[0]:
+                break
+            self._linearization[moved] = self._poses[moved]
+            self._stale[:self.n_edges] |= (np.isin(self.edge_i, moved) |
+                                           np.isin(self.edge_j, moved))
+        return count
+
+    def _linearize(self, edges):
+        Xi = self._linearization[self._edge_i[edges]]
+        Xj = self._linearization[self._edge_j[edges]]
+        Xi_inv = invert_poses(Xi)
+
+        # e = log(Z^-1 Xi^-1 Xj), de/dxj = I, de/dxi = -Adj(Xj^-1 Xi)
+        e = pose_error(invert_poses(self._measurements[edges]) @ Xi_inv @ Xj)
+        Ji = -adjoint(invert_poses(Xj) @ Xi)
+        omega = self._information[edges]
+
+        JiT_omega = np.swapaxes(Ji, -1, -2) @ omega
+        self._blocks[edges] = np.stack((JiT_omega @ Ji, JiT_omega,
+                                        omega @ Ji, omega), axis=1)
+        self._gradients[edges, 0] = np.einsum('eij,ej->ei', JiT_omega, e)
+        self._gradients[edges, 1] = np.einsum('eij,ej->ei', omega, e)
+        self._stale[edges] = False
+
+    def _solve(self):
+        n, m = self.n_nodes, self.n_edges
+        H = coo_matrix((self._blocks[:m].ravel(),
+                        (self._rows[:m].ravel(), self._cols[:m].ravel())),
+                       shape=(6 * n, 6 * n))
+
+        b = np.zeros((n, 6))
+        np.add.at(b, self.edge_i, self._gradients[:m, 0])
+        np.add.at(b, self.edge_j, self._gradients[:m, 1])
+
+        # fix the gauge freedom on the first node
+        H = H.tocsc() + coo_matrix(
+            (np.full(6, 1e9), (np.arange(6), np.arange(6))),
+            shape=(6 * n, 6 * n)).tocsc()
+
+        return spsolve(H, -b.ravel())
+
+    def _grow(self, names):
+        for name in names:
+            array = getattr(self, name)
+            grown = np.zeros((2 * array.shape[0],) + array.shape[1:],
+                             dtype=array.dtype)
+            grown[:array.shape[0]] = array
+            setattr(self, name, grown)
+
+
+class KeyframeIndex:
+    """
+    Voxel hashed spatial index over keyframe positions, updated per insert
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = dict()  # (ix, iy, iz) -> keyframe ids
+        self.positions = []
+
+    def insert(self, position):
+        self.positions.append(np.array(position))
+        self.cells.setdefault(self._cell(position), []).append(
+            len(self.positions) - 1)
+
+    def update(self, positions):
+        """
+        Rebuild the index with optimized keyframe positions
+        """
+        self.cells = dict()
+        self.positions = []
+        for position in positions:
+            self.insert(position)
+
+    def query(self, position, radius):
+        cx, cy, cz = self._cell(position)
+        reach = int(math.ceil(radius / self.cell_size))
+        ids = []
+        for dx in range(-reach, reach + 1):
+            for dy in range(-reach, reach + 1):
+                for dz in range(-reach, reach + 1):
+                    for k in self.cells.get((cx + dx, cy + dy, cz + dz), ()):
+                        if np.linalg.norm(self.positions[k] - position) <= radius:
+                            ids.append(k)
+        return sorted(ids)
+
+    def _cell(self, position):
+        return tuple(int(math.floor(p / self.cell_size)) for p in position)
+
+
+class PoseGraphSLAM:
+
+    def __init__(self):
+        self.graph = PoseGraph()
+        self.index = KeyframeIndex(LOOP_RADIUS)
+        self.keyframe_points = []  # down sampled clouds, keyframe frame
+        self.keyframe_association = None  # KD-tree of the last keyframe
+        self.relative_pose = np.eye(4)  # current frame in the last keyframe
+        self.information = np.eye(6)
+        self.loops = []
+
+    def process(self, points):
+        """
+        Track a new scan and update the pose graph
+
+        points: (3, N) points in the sensor frame
+        return: 4x4 pose of the scan in the map frame
+        """
+        if len(self.graph) == 0:
+            self._add_keyframe(points, np.eye(4))
+            return np.eye(4)
+
+        # frame to keyframe odometry, warm started at the previous frame
+        result = icp_registration(self.keyframe_points[-1], points,
+                                  nn_method=self.keyframe_association,
+                                  init_H=self.relative_pose)
+        self.relative_pose = result.H
+        pose = self.graph.poses[-1] @ self.relative_pose
+
+        translation = np.linalg.norm(self.relative_pose[0:3, 3])
+        angle = np.linalg.norm(pose_error(self.relative_pose)[3:6])
+        if translation > KEYFRAME_DISTANCE or angle > KEYFRAME_ANGLE:
+            previous = len(self.graph) - 1
+            current = self._add_keyframe(points, pose)
+            self.graph.add_edge(previous, current, self.relative_pose,
+                                self.information)
+            self.relative_pose = np.eye(4)
+            if self._detect_loops(current):
+                self.graph.optimize()
+                self.index.update(self.graph.poses[:, 0:3, 3])
+            pose = self.graph.poses[-1]
+
+        return pose
+
+    def _add_keyframe(self, points, pose):
+        down = voxel_down_sample(points, KEYFRAME_VOXEL_SIZE)
+        self.keyframe_points.append(down)
+        self.keyframe_association = KDTreeAssociation(
+            down, MAX_CORRESPONDENCE_DISTANCE)
+        self.index.insert(pose[0:3, 3])
+        return self.graph.add_node(pose)
+
+    def _detect_loops(self, current):
+        pose = self.graph.poses[current]
+        found = False
+        for candidate in self.index.query(pose[0:3, 3], LOOP_RADIUS):
+            if current - candidate < LOOP_MIN_GAP:
+                continue
+            target = self.keyframe_points[candidate]
+            source = self.keyframe_points[current]
+            guess = invert_poses(self.graph.poses[candidate]) @ pose
+            result = icp_registration(
+                target, source, init_H=guess,
+                nn_method=KDTreeAssociation(target,
+                                            MAX_CORRESPONDENCE_DISTANCE))
+            if result.residuals[-1] / source.shape[1] > LOOP_MAX_RESIDUAL:
+                continue
+            self.graph.add_edge(candidate, current, result.H,
+                                self.information)
+            self.loops.append((candidate, current))
+            found = True
+        return found
+
+
+def main():
+    print(__file__ + " start!!")
+
+    # simulation parameters: blobs in a 60 m x 60 m area, circular path
+    np.random.seed(1)
+    nBlob = 2000
+    sensorRange = 10.0  # [m]
+    radius = 20.0  # [m]
+    nFrame = 250
+    noise = 0.02  # [m]
+
+    centers = (np.random.rand(3, nBlob) - 0.5) * np.array([[60], [60], [6]])
+    scene = np.repeat(centers, 20, axis=1) + np.random.randn(3, nBlob * 20) * 0.2
+
+    slam = PoseGraphSLAM()
+    true_xy, est_xy = [], []
+    origin_inv = None
+    for k in range(nFrame + 10):  # drive a bit more than one full circle
+        yaw = 2.0 * math.pi * k / nFrame
+        R = Rot.from_euler('z', yaw + math.pi / 2).as_matrix()
+        t = np.array([radius * math.cos(yaw), radius * math.sin(yaw), 0.0])
+        visible = scene[:, np.linalg.norm(scene[0:2] - t[0:2, None], axis=0)
+                        < sensorRange]
+        points = R.T @ (visible - t[:, None])
+        points += np.random.randn(*points.shape) * noise
+
+        pose = slam.process(points)
+
+        true_pose = np.eye(4)
+        true_pose[0:3, 0:3] = R
+        true_pose[0:3, 3] = t
+        if origin_inv is None:
+            origin_inv = invert_poses(true_pose)
+        true_xy.append((origin_inv @ true_pose)[0:2, 3])
+        est_xy.append(pose[0:2, 3])
+
+    true_xy, est_xy = np.array(true_xy), np.array(est_xy)
+    print("keyframes:", len(slam.graph), "loops:", len(slam.loops))
+    print("final position error [m]:", np.linalg.norm(true_xy[-1] - est_xy[-1]))
+
+    if show_animation:  # pragma: no cover
+        keyframes = slam.graph.poses[:, 0:2, 3]
+        plt.plot(true_xy[:, 0], true_xy[:, 1], "-b", label="true")
+        plt.plot(est_xy[:, 0], est_xy[:, 1], "-r", label="estimate")
+        plt.plot(keyframes[:, 0], keyframes[:, 1], ".k", label="keyframes")
+        for i, j in slam.loops:
+            plt.plot(keyframes[[i, j], 0], keyframes[[i, j], 1], "-g")
+        plt.axis("equal")
+        plt.legend()
+        plt.show()
+
+
+if __name__ == '__main__':
+    main()
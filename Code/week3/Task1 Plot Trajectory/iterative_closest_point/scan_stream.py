@@ -0,0 +1,110 @@
+"""
+Streaming scan ingestion for ICP SLAM
+
+scan_stream yields point clouds from .npy, .pcd or .ply files while a
+background thread already loads the next ones. The prefetch queue is
+bounded, so the loader blocks (backpressure) when registration falls
+behind instead of reading the whole sequence into memory.
+
+.npy files are memory mapped, the loader thread only touches their pages so
+the registration thread does not wait on disk reads. .pcd and .ply files
+are decoded with open3d, which is only needed for those formats.
+"""
+
+import os
+import queue
+import threading
+
+import numpy as np
+
+SCAN_EXTENSIONS = (".npy", ".pcd", ".ply")
+PREFETCH = 4  # number of decoded scans waiting in the queue
+PAGE_SIZE = 4096  # [byte]
+
+_END = object()
+
+
+def load_scan(path):
+    """
+    Load a point cloud file
+
+    path: .npy file with an (N, 3) array, .pcd or .ply file
+    return: (3, N) points, a view into a read-only memory map for .npy
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".npy":
+        points = np.load(path, mmap_mode="r")
+        # fault the pages in here instead of in the registration thread
+        flat = np.ravel(points, order="K")
+        step = max(PAGE_SIZE // points.itemsize, 1)
+        np.add.reduce(flat[::step])
+        return points.T
+    elif extension in (".pcd", ".ply"):
+        import open3d as o3d
+        pc = o3d.io.read_point_cloud(path)
+        return np.asarray(pc.points).T
+    else:
+        raise ValueError("Unknown scan format: " + path)
+
+
+def list_scans(directory):
+    """
+    Scan files of a directory in name order
+    """
+    return [os.path.join(directory, name)
+            for name in sorted(os.listdir(directory))
+            if os.path.splitext(name)[1].lower() in SCAN_EXTENSIONS]
+
+
+def scan_stream(paths, prefetch=PREFETCH, loader=load_scan):
+    """
+    Yield scans while the next ones are loaded on a background thread
+
+    paths: directory or iterable of scan file paths
+    prefetch: maximum number of loaded scans waiting to be consumed
+    loader: function path -> (3, N) points
+    - output
+    generator of (path, points)
+
+    Loader errors are raised in the consuming thread. Closing the
+    generator stops the loader thread.
+    """
+    if isinstance(paths, str):
+        paths = list_scans(paths)
+
+    scans = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+
+    def put(item):
+        # blocks while the queue is full, wakes up to check for stop
+        while not stop.is_set():
+            try:
+                scans.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def load():
+        try:
+            for path in paths:
+                if not put((path, loader(path))):
+                    return
+        except Exception as e:
+            put(e)
+            return
+        put(_END)
+
+    thread = threading.Thread(target=load, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = scans.get()
+            if item is _END:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
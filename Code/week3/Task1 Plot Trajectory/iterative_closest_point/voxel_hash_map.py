@@ -0,0 +1,311 @@
+"""
+Incremental voxel hashed point cloud map for ICP SLAM
+
+The map keeps at most max_points_per_voxel points and a running centroid in
+every voxel, so its size is bounded by the explored volume instead of the
+number of frames. With max_age, voxels that have not been observed in the
+last max_age frames are evicted, which bounds the map to a sliding window.
+Registration runs against the voxel centroids. Correspondences are searched
+in the neighboring voxels through the same hash, so nothing is rebuilt
+when the map changes.
+"""
+
+import math
+
+import numpy as np
+
+KEY_BITS = 21  # bits per axis of a packed voxel key
+KEY_OFFSET = 1 << (KEY_BITS - 1)
+
+
+def voxel_keys(points, voxel_size):
+    """
+    Packed int64 voxel key of every point, KEY_BITS per axis
+
+    points: (dim, N) points
+    """
+    ixyz = np.floor(points / voxel_size).astype(np.int64) + KEY_OFFSET
+    keys = np.zeros(points.shape[1], dtype=np.int64)
+    for i in range(points.shape[0]):
+        keys |= ixyz[i] << (KEY_BITS * i)
+    return keys
+
+
+class VoxelHashMap:
+
+    def __init__(self, voxel_size, max_points_per_voxel=20, max_age=None,
+                 max_distance=None, dim=3, capacity=1024):
+        """
+        voxel_size: voxel edge length [m]
+        max_points_per_voxel: points stored per voxel, later points are
+            only accumulated into the centroid
+        max_age: evict voxels not observed in the last max_age frames,
+            None keeps every voxel
+        max_distance: maximum correspondence distance of the association
+            returned by index(), None searches the neighboring voxels
+        dim: 2 or 3
+        capacity: initial number of voxel slots, grows on demand
+        """
+        self.voxel_size = voxel_size
+        self.max_points_per_voxel = max_points_per_voxel
+        self.max_age = max_age
+        self.max_distance = max_distance
+        self.dim = dim
+        self.frame = 0
+
+        self.slots = dict()  # packed voxel key -> slot
+        # sorted copy of the hash for vectorized lookups, patched with the
+        # added and evicted keys only
+        self.sorted_keys = np.zeros(0, dtype=np.int64)
+        self.sorted_slots = np.zeros(0, dtype=np.int64)
+        self.free_slots = list(range(capacity - 1, -1, -1))
+        self.keys = np.zeros(capacity, dtype=np.int64)
+        self.used = np.zeros(capacity, dtype=bool)
+        self.sums = np.zeros((capacity, dim))
+        self.centroid = np.zeros((dim, capacity))  # (dim, M) for the search
+        self.counts = np.zeros(capacity, dtype=np.int64)
+        self.n_points = np.zeros(capacity, dtype=np.int64)
+        self.points = np.zeros((capacity, max_points_per_voxel, dim))
+        self.last_frame = np.zeros(capacity, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def voxel_keys(self, points):
+        """
+        Packed int64 voxel key of every point
+
+        points: (dim, N) points
+        """
+        return voxel_keys(points, self.voxel_size)
+
+    def insert(self, points):
+        """
+        Add a registered frame to the map
+
+        points: (dim, N) points in the map frame
+        """
+        self.frame += 1
+        keys = self.voxel_keys(points)
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+
+        slot_of_key = np.empty(unique_keys.shape[0], dtype=np.int64)
+        new = []
+        for i, key in enumerate(unique_keys.tolist()):
+            slot = self.slots.get(key)
+            if slot is None:
+                slot = self._new_slot(key)
+                new.append(i)
+            slot_of_key[i] = slot
+        slot_of_point = slot_of_key[inverse]
+        if new:
+            position = np.searchsorted(self.sorted_keys, unique_keys[new])
+            self.sorted_keys = np.insert(self.sorted_keys, position,
+                                         unique_keys[new])
+            self.sorted_slots = np.insert(self.sorted_slots, position,
+                                          slot_of_key[new])
+
+        # centroids
+        np.add.at(self.sums, slot_of_point, points.T)
+        np.add.at(self.counts, slot_of_point, 1)
+        self.centroid[:, slot_of_key] = (self.sums[slot_of_key] /
+                                         self.counts[slot_of_key, np.newaxis]).T
+        self.last_frame[slot_of_key] = self.frame
+
+        # bounded raw points: the rank of every point inside its voxel
+        order = np.argsort(inverse, kind="stable")
+        first = np.searchsorted(inverse[order], np.arange(unique_keys.shape[0]))
+        rank = np.empty_like(order)
+        rank[order] = np.arange(order.shape[0]) - first[inverse[order]]
+        position = self.n_points[slot_of_point] + rank
+        keep = position < self.max_points_per_voxel
+        self.points[slot_of_point[keep], position[keep]] = points.T[keep]
+        np.minimum(self.n_points + np.bincount(
+            slot_of_point, minlength=self.n_points.shape[0]),
+            self.max_points_per_voxel, out=self.n_points)
+
+        if self.max_age is not None:
+            self.evict(self.frame - self.max_age + 1)
+
+    def evict(self, oldest_frame):
+        """
+        Remove the voxels whose last observation is before oldest_frame
+        """
+        stale = np.flatnonzero(self.used & (self.last_frame < oldest_frame))
+        for slot in stale.tolist():
+            del self.slots[int(self.keys[slot])]
+            self.free_slots.append(slot)
+        if stale.shape[0]:
+            position = np.searchsorted(self.sorted_keys, self.keys[stale])
+            self.sorted_keys = np.delete(self.sorted_keys, position)
+            self.sorted_slots = np.delete(self.sorted_slots, position)
+        self.used[stale] = False
+        self.sums[stale] = 0.0
+        self.centroid[:, stale] = 0.0
+        self.counts[stale] = 0
+        self.n_points[stale] = 0
+
+    def centroids(self):
+        """
+        Centroid of every voxel, (dim, M)
+        """
+        used = self.used
+        return (self.sums[used] / self.counts[used, np.newaxis]).T
+
+    def all_points(self):
+        """
+        Every stored point, (dim, K) with K <= M * max_points_per_voxel
+        """
+        slot, position = np.nonzero(
+            np.arange(self.max_points_per_voxel) < self.n_points[:, np.newaxis])
+        return self.points[slot, position].T
+
+    def index(self):
+        """
+        Map points and nearest neighbor association for icp_registration
+
+        The map points are the centroids of every voxel slot, a view that
+        the inserts keep up to date. Free slots are never associated. The
+        association is only valid until the next insert.
+        return: (centroids, association)
+        """
+        return self.centroid, VoxelAssociation(self)
+
+    def lookup(self, keys):
+        """
+        Slot of every packed voxel key, -1 for keys not in the map
+        """
+        if not self.sorted_keys.shape[0]:
+            return np.full(np.shape(keys), -1, dtype=np.int64)
+        position = np.searchsorted(self.sorted_keys, keys)
+        np.minimum(position, self.sorted_keys.shape[0] - 1, out=position)
+        slots = self.sorted_slots.take(position)
+        slots[self.sorted_keys.take(position) != keys] = -1
+        return slots
+
+    def _new_slot(self, key):
+        if not self.free_slots:
+            self._grow()
+        slot = self.free_slots.pop()
+        self.slots[key] = slot
+        self.keys[slot] = key
+        self.used[slot] = True
+        return slot
+
+    def _grow(self):
+        old = self.keys.shape[0]
+        new = max(2 * old, 1)
+        for name in ("keys", "used", "sums", "counts", "n_points", "points",
+                     "last_frame"):
+            array = getattr(self, name)
+            grown = np.zeros((new,) + array.shape[1:], dtype=array.dtype)
+            grown[:old] = array
+            setattr(self, name, grown)
+        centroid = np.zeros((self.dim, new))
+        centroid[:, :old] = self.centroid
+        self.centroid = centroid
+        self.free_slots.extend(range(new - 1, old - 1, -1))
+
+
+class VoxelAssociation:
+    """
+    Nearest voxel centroid association over the hash of a VoxelHashMap
+
+    Every point is compared with the centroids of the voxels within
+    max_distance (one voxel if None) around its own voxel, found by key in
+    the map. The ring of adjacent voxels is searched first. A centroid lies
+    inside its voxel, so the outer shells are only searched for the points
+    whose best centroid is further away than the outside of their ring.
+    Points without a centroid within max_distance are rejected: their
+    index is the number of voxel slots and they add max_distance to the
+    residual.
+
+    The neighbour slots of every voxel key queried are kept, the ICP
+    iterations of a registration mostly query the same voxels. The
+    association is therefore only valid until the next insert, see
+    VoxelHashMap.index().
+    """
+
+    def __init__(self, voxel_map):
+        self.voxel_map = voxel_map
+        self.radius = voxel_map.max_distance or voxel_map.voxel_size
+        r = math.ceil(self.radius / voxel_map.voxel_size)
+        offsets = np.stack(np.meshgrid(*[np.arange(-r, r + 1)] *
+                                       voxel_map.dim, indexing="ij"),
+                           axis=-1).reshape(-1, voxel_map.dim)
+        # packed keys are linear in the voxel coordinates
+        key_offsets = offsets @ (np.int64(1) << (
+            KEY_BITS * np.arange(voxel_map.dim, dtype=np.int64)))
+        ring = np.abs(offsets).max(axis=1) <= 1
+        self.ring_offsets = key_offsets[ring]
+        self.shell_offsets = key_offsets[~ring]
+        # name -> (sorted voxel keys, slots of their neighbours), valid until
+        # the next insert into the map
+        self.cache = {}
+
+    def __call__(self, previous_points, current_points):
+        voxel_map = self.voxel_map
+        points = current_points
+        keys = voxel_map.voxel_keys(current_points)
+        indexes, d2 = self.search(points, keys, "ring")
+
+        if self.shell_offsets.shape[0]:
+            # distance from every point to the outside of its ring
+            cell = points / voxel_map.voxel_size
+            cell -= np.floor(cell)
+            margin = np.minimum(cell, 1.0 - cell).min(axis=0)
+            margin += 1.0
+            margin *= voxel_map.voxel_size
+            far = np.flatnonzero(~(d2 <= margin * margin))
+            if far.shape[0]:
+                shell_indexes, shell_d2 = self.search(
+                    points[:, far], keys[far], "shell")
+                closer = shell_d2 < d2[far]
+                indexes[far[closer]] = shell_indexes[closer]
+                d2[far[closer]] = shell_d2[closer]
+
+        d = np.sqrt(d2)
+        rejected = ~(d <= self.radius)
+        indexes[rejected] = voxel_map.keys.shape[0]
+        d[rejected] = self.radius
+        return indexes, np.sum(d)
+
+    def search(self, points, keys, name):
+        # nearest centroid in the ring or shell voxels around every point,
+        # the map is queried once per distinct voxel key and offset
+        voxel_map = self.voxel_map
+        keys, inverse = np.unique(keys, return_inverse=True)
+        cached_keys, table = self.cache.get(name, (np.zeros(0, np.int64),
+                                                   None))
+        position = np.searchsorted(cached_keys, keys)
+        missing = position == cached_keys.shape[0]
+        missing[~missing] = cached_keys[position[~missing]] != keys[~missing]
+        if missing.any():
+            # one sorted query per offset for the keys not seen yet
+            new_keys = keys[missing]
+            new_table = voxel_map.lookup(
+                getattr(self, name + "_offsets")[:, np.newaxis] + new_keys)
+            insert = np.searchsorted(cached_keys, new_keys)
+            cached_keys = np.insert(cached_keys, insert, new_keys)
+            table = new_table if table is None else np.insert(
+                table, insert, new_table, axis=1)
+            self.cache[name] = cached_keys, table
+            position = np.searchsorted(cached_keys, keys)
+        inverse = position.take(inverse)
+
+        best_slots = np.full(points.shape[1], -1, dtype=np.int64)
+        best_d2 = np.full(points.shape[1], np.inf)
+        d2 = np.empty(points.shape[1])
+        delta = np.empty(points.shape[1])
+        for slots in table:
+            slots = slots.take(inverse)
+            d2.fill(0.0)
+            for centroid, coordinate in zip(voxel_map.centroid, points):
+                np.subtract(centroid.take(slots), coordinate, out=delta)
+                delta *= delta
+                d2 += delta
+            closer = d2 < best_d2
+            closer &= slots >= 0
+            np.copyto(best_d2, d2, where=closer)
+            np.copyto(best_slots, slots, where=closer)
+        return best_slots, best_d2
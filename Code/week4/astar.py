@@ -9,16 +9,75 @@ See Wikipedia article (https://en.wikipedia.org/wiki/A*_search_algorithm)
 
 """
 
+import hashlib
+import heapq
 import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 import matplotlib.pyplot as plt
+import numpy as np
 
 show_animation = True
 
+OBSTACLE_CHUNK_CELLS = 1 << 20  # candidate cells per obstacle map chunk
+ALT_LANDMARKS = 16  # landmark cells of the ALT heuristic
+ALT_ACTIVE = 4  # landmarks used per query, the tightest at the start
+ALT_UNREACHABLE = 1e30  # landmark distance of cells the landmark can't reach
+
+
+class PlanningStats:
+    """
+    Counters, phase timing and expansion trace of the last search
+
+    Assign an instance to AStarPlanner.stats to collect them. With stats
+    None, the default, the search reads no clock and records nothing; the
+    counters are derived from the search state after the loop. Counters a
+    planner does not record stay None and are not printed.
+    """
+
+    def __init__(self, trace=False):
+        """
+        trace: record the grid index of every expanded node in order
+        """
+        self.trace_enabled = trace
+        self.map_time = 0.0  # obstacle map build or load [s]
+        self.search_time = 0.0  # [s]
+        self.path_time = 0.0  # path reconstruction [s]
+        self.expanded = 0  # nodes moved to the closed set
+        self.generated = None  # distinct nodes pushed to the open heap
+        # pushes of an open node with a lower cost, the lazy decrease-key
+        self.decrease_key_pushes = None
+        self.heap_pushes = None
+        self.heap_pops = None  # including outdated entries
+        self.trace = None  # int64 grid indexes of the expanded nodes
+
+    def record_search(self, expanded, generated, heap_pops, heap_left,
+                      trace):
+        self.expanded = expanded
+        self.generated = generated
+        self.heap_pops = heap_pops
+        self.heap_pushes = heap_pops + heap_left
+        self.decrease_key_pushes = self.heap_pushes - generated
+        self.trace = None if trace is None else np.array(trace,
+                                                         dtype=np.int64)
+
+    def __str__(self):
+        text = "map: %.4f s, search: %.4f s, path: %.4f s, expanded: %d" % (
+            self.map_time, self.search_time, self.path_time, self.expanded)
+        for name, value in (("generated", self.generated),
+                            ("decrease-key pushes", self.decrease_key_pushes),
+                            ("heap pushes", self.heap_pushes),
+                            ("heap pops", self.heap_pops)):
+            if value is not None:
+                text += ", %s: %d" % (name, value)
+        return text
+
 
 class AStarPlanner:
 
-    def __init__(self, ox, oy, resolution, rr):
+    def __init__(self, ox, oy, resolution, rr, cache_dir=None):
         """
         Initialize grid map for a star planning
 
@@ -26,6 +85,9 @@ class AStarPlanner:
         oy: y position list of Obstacles [m]
         resolution: grid resolution [m]
         rr: robot radius[m]
+        cache_dir: directory the obstacle map is saved to, keyed by the
+            obstacles, resolution and radius, and memory mapped from on
+            the next construction with the same inputs. None disables it.
         """
 
         self.resolution = resolution
@@ -34,10 +96,24 @@ class AStarPlanner:
         self.max_x, self.max_y = 0, 0
         self.obstacle_map = None
         self.x_width, self.y_width = 0, 0
+        self.cache_path = None
+        self.n_expanded = 0  # nodes expanded by the last search
+        self.stats = None  # PlanningStats of the last search, if set
+        # ALT heuristic tables, see calc_landmarks
+        self.landmarks, self.landmark_dist = None, None
+        self.landmark_path = None  # saved landmark_dist next to cache_path
+        self.landmark_tolerance = 0.0
         self.motion = self.get_motion_model()
-        self.calc_obstacle_map(ox, oy)
+        start = time.perf_counter()
+        if cache_dir is None:
+            self.calc_obstacle_map(ox, oy)
+        else:
+            self.load_obstacle_map(ox, oy, cache_dir)
+        self.map_time = time.perf_counter() - start
 
     class Node:
+        __slots__ = ("x", "y", "cost", "parent_index")
+
         def __init__(self, x, y, cost, parent_index):
             self.x = x  # index of grid
             self.y = y  # index of grid
@@ -59,88 +135,407 @@ class AStarPlanner:
             gy: goal y position [m]
 
         output:
-            rx: x position list of the final path
-            ry: y position list of the final path
+            rx: x position list of the final path, empty if there is none
+            ry: y position list of the final path, empty if there is none
         """
+        stats = self.stats
+        if stats is not None:
+            search_start = time.perf_counter()
+        trace = [] if stats is not None and stats.trace_enabled else None
 
         start_node = self.Node(self.calc_xy_index(sx, self.min_x),
                                self.calc_xy_index(sy, self.min_y), 0.0, -1)
         goal_node = self.Node(self.calc_xy_index(gx, self.min_x),
                               self.calc_xy_index(gy, self.min_y), 0.0, -1)
-
-        open_set, closed_set = dict(), dict()
-        open_set[self.calc_grid_index(start_node)] = start_node
+        if not (self.in_grid(start_node) and self.in_grid(goal_node)):
+            print("Start or goal is outside of the grid..")
+            return [], []
+
+        # search state in flat arrays indexed by calc_grid_index instead of
+        # a Node object per cell: g cost (inf while undiscovered), parent
+        # index (-1 for none) and closed flag
+        width = self.x_width
+        n_cells = self.x_width * self.y_width
+        cost = np.full(n_cells, np.inf)
+        parent = np.full(n_cells, -1,
+                         dtype=np.int32 if n_cells < 2 ** 31 else np.int64)
+        closed = np.zeros(n_cells, dtype=bool)
+        # memoryviews for fast scalar access from the Python loop
+        cost_v, parent_v, closed_v = (memoryview(cost), memoryview(parent),
+                                      memoryview(closed))
+        blocked_v = memoryview(self.obstacle_map.ravel(order="F"))
+        motion = [(dx, dy, dc, dy * width + dx) for dx, dy, dc in self.motion]
+
+        start_id = self.calc_grid_index(start_node)
+        goal_id = self.calc_grid_index(goal_node)
+        goal_x, goal_y = goal_node.x, goal_node.y
+        cost_v[start_id] = 0.0
+
+        # ALT: (landmark to goal distance, landmark distance table) of the
+        # landmarks with the tightest bound at the start
+        landmarks = []
+        if self.landmark_dist is not None:
+            dist = self.landmark_dist
+            bound = np.abs(dist[:, goal_id] - dist[:, start_id])
+            bound[(dist[:, goal_id] >= ALT_UNREACHABLE) |
+                  (dist[:, start_id] >= ALT_UNREACHABLE)] = -1.0
+            active = np.argsort(-bound, kind="stable")[:ALT_ACTIVE]
+            landmarks = [(float(dist[i, goal_id]), memoryview(dist[i]))
+                         for i in active.tolist()]
+        tolerance = self.landmark_tolerance
+
+        # binary heap of (f, h, index) with f and h cached at push time.
+        # decrease-key is lazy: an improved node is pushed again and the
+        # outdated entries are skipped when they are popped.
+        h = max(self.calc_heuristic(goal_node, start_node),
+                self.calc_landmark_heuristic(start_id, goal_id))
+        open_heap = [(h, h, start_id)]
+        n_closed, n_popped = 0, 0
 
         while True:
-            if len(open_set) == 0:
+            if len(open_heap) == 0:
                 print("Open set is empty..")
                 break
 
-            c_id = min(
-                open_set,
-                key=lambda o: open_set[o].cost + self.calc_heuristic(goal_node,
-                                                                     open_set[
-                                                                         o]))
-            current = open_set[c_id]
-
-            # show graph
-            if show_animation:  # pragma: no cover
-                plt.plot(self.calc_grid_position(current.x, self.min_x),
-                         self.calc_grid_position(current.y, self.min_y), "xc")
-                # for stopping simulation with the esc key.
-                plt.gcf().canvas.mpl_connect('key_release_event',
-                                             lambda event: [exit(
-                                                 0) if event.key == 'escape' else None])
-                if len(closed_set.keys()) % 10 == 0:
-                    plt.pause(0.001)
-
-            if current.x == goal_node.x and current.y == goal_node.y:
+            _, _, c_id = heapq.heappop(open_heap)
+            n_popped += 1
+            if closed_v[c_id]:  # outdated entry
+                continue
+            c_y, c_x = divmod(c_id, width)
+            if trace is not None:
+                trace.append(c_id)
+
+            if c_id == goal_id:
                 print("Find goal")
-                goal_node.parent_index = current.parent_index
-                goal_node.cost = current.cost
                 break
 
-            # Remove the item from the open set
-            del open_set[c_id]
-
             # Add it to the closed set
-            closed_set[c_id] = current
+            closed_v[c_id] = True
+            n_closed += 1
+            c_cost = cost_v[c_id]
 
             # expand_grid search grid based on motion model
-            for i, _ in enumerate(self.motion):
-                node = self.Node(current.x + self.motion[i][0],
-                                 current.y + self.motion[i][1],
-                                 current.cost + self.motion[i][2], c_id)
-                n_id = self.calc_grid_index(node)
-
-                # If the node is not safe, do nothing
-                if not self.verify_node(node):
+            for dx, dy, dc, offset in motion:
+                x, y = c_x + dx, c_y + dy
+                if x < 0 or y < 0 or x >= width or y >= self.y_width:
                     continue
+                n_id = c_id + offset
 
-                if n_id in closed_set:
+                # If the node is not safe, or already closed, do nothing
+                if blocked_v[n_id] or closed_v[n_id]:
                     continue
 
-                if n_id not in open_set:
-                    open_set[n_id] = node  # discovered a new node
-                else:
-                    if open_set[n_id].cost > node.cost:
-                        # This path is the best until now. record it
-                        open_set[n_id] = node
+                n_cost = c_cost + dc
+                if n_cost >= cost_v[n_id]:
+                    continue
+                # This path is the best until now. record it
+                cost_v[n_id] = n_cost
+                parent_v[n_id] = c_id
+
+                h = math.hypot(goal_x - x, goal_y - y)
+                for goal_d, dist in landmarks:
+                    d = abs(goal_d - dist[n_id]) - tolerance
+                    if d > h:
+                        h = d
+                heapq.heappush(open_heap, (n_cost + h, h, n_id))
+
+        self.n_expanded = n_closed
+        if stats is not None:
+            path_start = time.perf_counter()
+            stats.record_search(n_closed, int(np.count_nonzero(cost < np.inf)),
+                                n_popped, len(open_heap), trace)
+        if math.isinf(cost_v[goal_id]):  # the open set ran empty
+            rx, ry = [], []
+        else:
+            rx, ry = self.calc_final_path(goal_id, parent)
+        if stats is not None:
+            stats.map_time = self.map_time
+            stats.search_time = path_start - search_start
+            stats.path_time = time.perf_counter() - path_start
+
+        return rx, ry
+
+    def planning_jps(self, sx, sy, gx, gy):
+        """
+        Jump Point Search
+
+        Same optimal path lengths as planning on the 8-connected grid of
+        get_motion_model, but only jump points (the start, the goal and
+        the cells where an obstacle forces a turn) are pushed to the open
+        heap, so far fewer nodes are expanded.
+
+        input:
+            s_x: start x position [m]
+            s_y: start y position [m]
+            gx: goal x position [m]
+            gy: goal y position [m]
+
+        output:
+            rx: x position list of the final path, every grid cell, empty
+                if there is none
+            ry: y position list of the final path, every grid cell, empty
+                if there is none
+        """
+        stats = self.stats
+        if stats is not None:
+            search_start = time.perf_counter()
+        trace = [] if stats is not None and stats.trace_enabled else None
 
-        rx, ry = self.calc_final_path(goal_node, closed_set)
+        start_node = self.Node(self.calc_xy_index(sx, self.min_x),
+                               self.calc_xy_index(sy, self.min_y), 0.0, -1)
+        goal_node = self.Node(self.calc_xy_index(gx, self.min_x),
+                              self.calc_xy_index(gy, self.min_y), 0.0, -1)
+        if not (self.in_grid(start_node) and self.in_grid(goal_node)):
+            print("Start or goal is outside of the grid..")
+            return [], []
+
+        # obstacle map with a border of blocked cells, so that jumps stop
+        # at the map edge without bounds checks. p = (y + 1) * width + x + 1
+        width = self.x_width + 2
+        blocked = np.ones((self.x_width + 2, self.y_width + 2), dtype=bool,
+                          order="F")
+        blocked[1:-1, 1:-1] = self.obstacle_map
+        blocked_v = memoryview(blocked.ravel(order="F"))
+        n_cells = blocked.size
+        cost = np.full(n_cells, np.inf)
+        parent = np.full(n_cells, -1,
+                         dtype=np.int32 if n_cells < 2 ** 31 else np.int64)
+        closed = np.zeros(n_cells, dtype=bool)
+        cost_v, parent_v, closed_v = (memoryview(cost), memoryview(parent),
+                                      memoryview(closed))
+
+        start_id = (start_node.y + 1) * width + start_node.x + 1
+        goal_id = (goal_node.y + 1) * width + goal_node.x + 1
+        goal_x, goal_y = goal_node.x + 1, goal_node.y + 1
+        sqrt2 = math.sqrt(2)
+
+        def jump_straight(p, d, side):
+            # d: step along the row or column, side: step across it
+            while True:
+                p += d
+                if blocked_v[p]:
+                    return -1
+                if p == goal_id:
+                    return p
+                # forced neighbor: a wall beside p ends right here
+                if (blocked_v[p + side] and not blocked_v[p + d + side]) or \
+                        (blocked_v[p - side] and not blocked_v[p + d - side]):
+                    return p
+
+        def jump_diagonal(p, dx, dy):
+            dyw = dy * width
+            d = dx + dyw
+            while True:
+                p += d
+                if blocked_v[p]:
+                    return -1
+                if p == goal_id:
+                    return p
+                if (blocked_v[p - dx] and not blocked_v[p - dx + dyw]) or \
+                        (blocked_v[p - dyw] and not blocked_v[p + dx - dyw]):
+                    return p
+                # a jump point straight ahead makes p a jump point
+                if jump_straight(p, dx, width) != -1 or \
+                        jump_straight(p, dyw, 1) != -1:
+                    return p
+
+        def jump(p, dx, dy):
+            if dx == 0:
+                return jump_straight(p, dy * width, 1)
+            if dy == 0:
+                return jump_straight(p, dx, width)
+            return jump_diagonal(p, dx, dy)
+
+        def pruned_directions(p, x, y):
+            # natural and forced neighbor directions of a jump point
+            q = parent_v[p]
+            if q == -1:
+                return [(dx, dy) for dx, dy, _ in self.motion]
+            qy, qx = divmod(q, width)
+            dx = (x > qx) - (x < qx)
+            dy = (y > qy) - (y < qy)
+            if dx != 0 and dy != 0:
+                directions = [(0, dy), (dx, 0), (dx, dy)]
+                if blocked_v[p - dx]:
+                    directions.append((-dx, dy))
+                if blocked_v[p - dy * width]:
+                    directions.append((dx, -dy))
+            elif dx != 0:
+                directions = [(dx, 0)]
+                if blocked_v[p + width]:
+                    directions.append((dx, 1))
+                if blocked_v[p - width]:
+                    directions.append((dx, -1))
+            else:
+                directions = [(0, dy)]
+                if blocked_v[p + 1]:
+                    directions.append((1, dy))
+                if blocked_v[p - 1]:
+                    directions.append((-1, dy))
+            return directions
+
+        cost_v[start_id] = 0.0
+        h = self.calc_heuristic(goal_node, start_node)
+        open_heap = [(h, h, start_id)]
+        n_closed, n_popped = 0, 0
+
+        while True:
+            if len(open_heap) == 0:
+                print("Open set is empty..")
+                break
+
+            _, _, c_id = heapq.heappop(open_heap)
+            n_popped += 1
+            if closed_v[c_id]:  # outdated entry
+                continue
+            c_y, c_x = divmod(c_id, width)
+            if trace is not None:
+                trace.append(c_id)
+
+            if c_id == goal_id:
+                print("Find goal")
+                break
+
+            closed_v[c_id] = True
+            n_closed += 1
+            c_cost = cost_v[c_id]
+
+            for dx, dy in pruned_directions(c_id, c_x, c_y):
+                n_id = jump(c_id, dx, dy)
+                if n_id == -1 or closed_v[n_id]:
+                    continue
+
+                # jumps are straight or diagonal runs
+                y, x = divmod(n_id, width)
+                n_steps = max(abs(x - c_x), abs(y - c_y))
+                n_cost = c_cost + (n_steps * sqrt2 if dx and dy else n_steps)
+                if n_cost >= cost_v[n_id]:
+                    continue
+                cost_v[n_id] = n_cost
+                parent_v[n_id] = c_id
+
+                h = math.hypot(goal_x - x, goal_y - y)
+                heapq.heappush(open_heap, (n_cost + h, h, n_id))
+
+        self.n_expanded = n_closed
+        if stats is not None:
+            path_start = time.perf_counter()
+            if trace is not None:  # padded to grid indexes
+                y, x = np.divmod(np.array(trace, dtype=np.int64), width)
+                trace = (y - 1) * self.x_width + x - 1
+            stats.record_search(n_closed, int(np.count_nonzero(cost < np.inf)),
+                                n_popped, len(open_heap), trace)
+
+        # fill in the cells between the jump points
+        rx, ry = [], []
+        index = goal_id if not math.isinf(cost_v[goal_id]) else -1
+        while index != -1:
+            y, x = divmod(index, width)
+            next_index = int(parent[index])
+            if next_index == -1:
+                n_steps, dx, dy = 1, 0, 0
+            else:
+                ny, nx = divmod(next_index, width)
+                n_steps = max(abs(nx - x), abs(ny - y))
+                dx, dy = (nx > x) - (nx < x), (ny > y) - (ny < y)
+            for i in range(n_steps):
+                rx.append(self.calc_grid_position(x - 1 + i * dx, self.min_x))
+                ry.append(self.calc_grid_position(y - 1 + i * dy, self.min_y))
+            index = next_index
+        if stats is not None:
+            stats.map_time = self.map_time
+            stats.search_time = path_start - search_start
+            stats.path_time = time.perf_counter() - path_start
 
         return rx, ry
 
-    def calc_final_path(self, goal_node, closed_set):
+    def planning_many(self, queries, workers=None, jump_point=False):
+        """
+        A star path search for many start/goal pairs on the same map
+
+        input:
+            queries: iterable of (sx, sy, gx, gy) [m]
+            workers: number of worker processes, None or 1 plans in this
+                process. Workers memory map the cached obstacle map and
+                landmark tables read-only, so the planner needs a
+                cache_dir.
+            jump_point: plan with planning_jps instead of planning
+
+        output:
+            list of (rx, ry), in query order, empty lists for the queries
+            without a path
+        """
+        queries = list(queries)
+        if workers is None or workers <= 1:
+            plan = self.planning_jps if jump_point else self.planning
+            return [plan(*query) for query in queries]
+
+        if self.cache_path is None:
+            raise ValueError("planning_many with workers needs a cache_dir")
+        chunksize = max(len(queries) // (4 * workers), 1)
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=(self.grid_state(),)) as executor:
+            return list(executor.map(_plan_query, queries,
+                                     [jump_point] * len(queries),
+                                     chunksize=chunksize))
+
+    def grid_state(self):
+        """
+        Grid parameters to rebuild the planner from its cached map
+        """
+        return {"resolution": self.resolution, "rr": self.rr,
+                "min_x": self.min_x, "min_y": self.min_y,
+                "max_x": self.max_x, "max_y": self.max_y,
+                "x_width": self.x_width, "y_width": self.y_width,
+                "cache_path": self.cache_path, "landmarks": self.landmarks,
+                "landmark_path": self.landmark_path,
+                "landmark_tolerance": self.landmark_tolerance}
+
+    @classmethod
+    def from_grid_state(cls, state):
+        """
+        Planner on the read-only memory maps of a cached obstacle map and
+        its landmark tables
+        """
+        planner = cls.__new__(cls)
+        planner.__dict__.update(state)
+        planner.n_expanded = 0
+        planner.stats, planner.map_time = None, 0.0
+        planner.motion = cls.get_motion_model()
+        planner.obstacle_map = np.load(state["cache_path"], mmap_mode="r")
+        planner.landmark_dist = None
+        if state["landmark_path"] is not None:
+            planner.landmark_dist = np.load(state["landmark_path"],
+                                            mmap_mode="r")
+        return planner
+
+    def draw_trace(self, trace, chunk=10):  # pragma: no cover
+        """
+        Replay an expansion trace such as PlanningStats.trace
+
+        :param trace: grid indexes in expansion order
+        :param chunk: nodes drawn per animation frame
+        """
+        # for stopping simulation with the esc key.
+        plt.gcf().canvas.mpl_connect('key_release_event',
+                                     lambda event: [exit(
+                                         0) if event.key == 'escape' else None])
+        trace = np.asarray(trace)
+        px = self.calc_grid_position(trace % self.x_width, self.min_x)
+        py = self.calc_grid_position(trace // self.x_width, self.min_y)
+        for i in range(0, trace.shape[0], chunk):
+            plt.plot(px[i:i + chunk], py[i:i + chunk], "xc")
+            plt.pause(0.001)
+
+    def calc_final_path(self, goal_index, parent):
         # generate final course
-        rx, ry = [self.calc_grid_position(goal_node.x, self.min_x)], [
-            self.calc_grid_position(goal_node.y, self.min_y)]
-        parent_index = goal_node.parent_index
-        while parent_index != -1:
-            n = closed_set[parent_index]
-            rx.append(self.calc_grid_position(n.x, self.min_x))
-            ry.append(self.calc_grid_position(n.y, self.min_y))
-            parent_index = n.parent_index
+        rx, ry = [], []
+        index = goal_index
+        while index != -1:
+            y, x = divmod(index, self.x_width)
+            rx.append(self.calc_grid_position(x, self.min_x))
+            ry.append(self.calc_grid_position(y, self.min_y))
+            index = int(parent[index])
 
         return rx, ry
 
@@ -150,6 +545,96 @@ class AStarPlanner:
         d = w * math.hypot(n1.x - n2.x, n1.y - n2.y)
         return d
 
+    def calc_landmarks(self, n_landmarks=ALT_LANDMARKS):
+        """
+        Landmark distance tables for the ALT heuristic
+
+        The grid distance from every landmark to every cell is computed
+        once with Dijkstra and kept as float32. By the triangle inequality
+        |d(L, goal) - d(L, n)| is a lower bound of the path cost from n to
+        the goal, which planning then uses as heuristic whenever it is
+        larger than the Euclidean distance. Landmarks are picked farthest
+        first, so they lie on the map boundary behind the obstacles.
+
+        With a cache_dir the tables are saved next to the cached obstacle
+        map, and memory mapped from there on the next call and by the
+        workers of planning_many.
+
+        :param n_landmarks: number of landmarks
+        """
+        from scipy.sparse import csr_matrix
+        from scipy.sparse.csgraph import dijkstra
+
+        if self.cache_path is not None:
+            self.landmark_path = self.cache_path[:-len(".npy")] + \
+                "_landmarks%d.npy" % n_landmarks
+            if os.path.exists(self.landmark_path):
+                self.landmark_dist = np.load(self.landmark_path,
+                                             mmap_mode="r")
+                # the distance of a landmark to itself is its only zero
+                self.landmarks = np.argmin(self.landmark_dist,
+                                           axis=1).tolist()
+                self.calc_landmark_tolerance()
+                print("load landmarks:", self.landmark_path)
+                return
+
+        # graph of the moves between free cells, both directions
+        free = ~np.asarray(self.obstacle_map)
+        n_cells = self.x_width * self.y_width
+        index = np.arange(n_cells).reshape((self.x_width, self.y_width),
+                                           order="F")
+        rows, cols, costs = [], [], []
+        for dx, dy, dc in self.motion:
+            a = (slice(max(-dx, 0), self.x_width - max(dx, 0)),
+                 slice(max(-dy, 0), self.y_width - max(dy, 0)))
+            b = (slice(max(dx, 0), self.x_width + min(dx, 0)),
+                 slice(max(dy, 0), self.y_width + min(dy, 0)))
+            both = free[a] & free[b]
+            rows.append(index[a][both])
+            cols.append(index[b][both])
+            costs.append(np.full(rows[-1].shape[0], dc))
+        graph = csr_matrix((np.concatenate(costs), (np.concatenate(rows),
+                                                    np.concatenate(cols))),
+                           shape=(n_cells, n_cells))
+
+        free_cells = np.flatnonzero(free.ravel(order="F"))
+        if free_cells.shape[0] == 0:
+            return
+        self.landmarks = []
+        self.landmark_dist = np.empty((n_landmarks, n_cells),
+                                      dtype=np.float32)
+        min_dist = dijkstra(graph, indices=int(free_cells[0]))
+        for i in range(n_landmarks):
+            landmark = int(np.argmax(np.where(np.isfinite(min_dist),
+                                              min_dist, -1.0)))
+            dist = dijkstra(graph, indices=landmark)
+            self.landmarks.append(landmark)
+            self.landmark_dist[i] = np.where(np.isfinite(dist), dist,
+                                             ALT_UNREACHABLE)
+            min_dist = np.minimum(min_dist, dist) if i else dist
+
+        self.calc_landmark_tolerance()
+        if self.landmark_path is not None:
+            # write then rename as the obstacle map
+            tmp_path = self.landmark_path + ".%d.tmp" % os.getpid()
+            with open(tmp_path, "wb") as f:
+                np.save(f, self.landmark_dist)
+            os.replace(tmp_path, self.landmark_path)
+            print("save landmarks:", self.landmark_path)
+        print("landmarks:", len(self.landmarks))
+
+    def calc_landmark_tolerance(self):
+        # float32 rounding must not make the bound overestimate
+        reach = self.landmark_dist[self.landmark_dist < ALT_UNREACHABLE]
+        self.landmark_tolerance = 2.0 * float(np.spacing(reach.max()))
+
+    def calc_landmark_heuristic(self, index, goal_index):
+        if self.landmark_dist is None:
+            return 0.0
+        dist = self.landmark_dist
+        return float(np.max(np.abs(dist[:, goal_index] - dist[:, index]))) \
+            - self.landmark_tolerance
+
     def calc_grid_position(self, index, min_position):
         """
         calc grid position
@@ -165,29 +650,35 @@ class AStarPlanner:
         return round((position - min_pos) / self.resolution)
 
     def calc_grid_index(self, node):
-        return (node.y - self.min_y) * self.x_width + (node.x - self.min_x)
+        # node.x and node.y are already grid indexes
+        return node.y * self.x_width + node.x
 
-    def verify_node(self, node):
-        px = self.calc_grid_position(node.x, self.min_x)
-        py = self.calc_grid_position(node.y, self.min_y)
+    def in_grid(self, node):
+        return 0 <= node.x < self.x_width and 0 <= node.y < self.y_width
 
-        if px < self.min_x:
-            return False
-        elif py < self.min_y:
-            return False
-        elif px >= self.max_x:
-            return False
-        elif py >= self.max_y:
+    def verify_node(self, node):
+        if not self.in_grid(node):
             return False
 
         # collision check
-        if self.obstacle_map[node.x][node.y]:
+        if self.obstacle_map[node.x, node.y]:
             return False
 
         return True
 
     def calc_obstacle_map(self, ox, oy):
 
+        self.calc_grid_size(ox, oy)
+
+        # obstacle map generation, indexed [x, y] and stored column major so
+        # that its flat view is indexed by calc_grid_index
+        self.obstacle_map = np.zeros((self.x_width, self.y_width), dtype=bool,
+                                     order="F")
+        ix, iy = self.calc_inflated_cells(ox, oy)
+        self.obstacle_map[ix, iy] = True
+
+    def calc_grid_size(self, ox, oy):
+
         self.min_x = round(min(ox))
         self.min_y = round(min(oy))
         self.max_x = round(max(ox))
@@ -202,18 +693,77 @@ class AStarPlanner:
         print("x_width:", self.x_width)
         print("y_width:", self.y_width)
 
-        # obstacle map generation
-        self.obstacle_map = [[False for _ in range(self.y_width)]
-                             for _ in range(self.x_width)]
-        for ix in range(self.x_width):
-            x = self.calc_grid_position(ix, self.min_x)
-            for iy in range(self.y_width):
-                y = self.calc_grid_position(iy, self.min_y)
-                for iox, ioy in zip(ox, oy):
-                    d = math.hypot(iox - x, ioy - y)
-                    if d <= self.rr:
-                        self.obstacle_map[ix][iy] = True
-                        break
+    def load_obstacle_map(self, ox, oy, cache_dir):
+        """
+        Memory map the cached obstacle map, build and save it on a miss
+
+        The cache file name is a hash of the obstacle positions, the
+        resolution and the robot radius.
+        """
+        key = hashlib.sha1()
+        key.update(np.asarray(ox, dtype=np.float64).tobytes())
+        key.update(np.asarray(oy, dtype=np.float64).tobytes())
+        key.update(np.array([self.resolution, self.rr],
+                            dtype=np.float64).tobytes())
+        self.cache_path = os.path.join(
+            cache_dir, "astar_" + key.hexdigest() + ".npy")
+
+        if os.path.exists(self.cache_path):
+            self.calc_grid_size(ox, oy)
+            print("load obstacle map:", self.cache_path)
+        else:
+            self.calc_obstacle_map(ox, oy)
+            os.makedirs(cache_dir, exist_ok=True)
+            # write then rename, so a concurrent reader never sees a
+            # partial file
+            tmp_path = self.cache_path + ".%d.tmp" % os.getpid()
+            with open(tmp_path, "wb") as f:
+                np.save(f, self.obstacle_map)
+            os.replace(tmp_path, self.cache_path)
+            print("save obstacle map:", self.cache_path)
+        self.obstacle_map = np.load(self.cache_path, mmap_mode="r")
+
+    def calc_inflated_cells(self, ox, oy):
+        """
+        Grid cells within robot radius of the obstacles
+
+        Every obstacle stamps a disk of radius rr: the cells of its bounding
+        box are checked with the exact distance from the cell position to
+        the obstacle, so the result equals a check of every cell against
+        every obstacle while the cost only grows with the number of
+        obstacles times the disk area.
+
+        :param ox: x position list of Obstacles [m]
+        :param oy: y position list of Obstacles [m]
+        :return: x and y index arrays of the blocked cells, may repeat
+        """
+        ox = np.asarray(ox, dtype=float)
+        oy = np.asarray(oy, dtype=float)
+
+        # disk stamp offsets around the lowest index the disk can reach,
+        # one cell of margin against rounding at the disk boundary
+        span = int(math.floor(2.0 * self.rr / self.resolution)) + 3
+        dx, dy = np.meshgrid(np.arange(span), np.arange(span), indexing="ij")
+        dx, dy = dx.ravel(), dy.ravel()
+
+        ix_list, iy_list = [], []
+        chunk = max(OBSTACLE_CHUNK_CELLS // dx.shape[0], 1)
+        for i in range(0, ox.shape[0], chunk):
+            cx, cy = ox[i:i + chunk, None], oy[i:i + chunk, None]
+            ix = np.ceil((cx - self.rr - self.min_x) /
+                         self.resolution).astype(np.int64) - 1 + dx
+            iy = np.ceil((cy - self.rr - self.min_y) /
+                         self.resolution).astype(np.int64) - 1 + dy
+            x = ix * self.resolution + self.min_x
+            y = iy * self.resolution + self.min_y
+            hit = ((np.hypot(cx - x, cy - y) <= self.rr) &
+                   (ix >= 0) & (ix < self.x_width) &
+                   (iy >= 0) & (iy < self.y_width))
+            ix_list.append(ix[hit])
+            iy_list.append(iy[hit])
+
+        return (np.concatenate(ix_list) if ix_list else np.zeros(0, int),
+                np.concatenate(iy_list) if iy_list else np.zeros(0, int))
 
     @staticmethod
     def get_motion_model():
@@ -230,6 +780,21 @@ class AStarPlanner:
         return motion
 
 
+_worker_planner = None
+
+
+def _init_worker(state):
+    global show_animation, _worker_planner
+    show_animation = False
+    _worker_planner = AStarPlanner.from_grid_state(state)
+
+
+def _plan_query(query, jump_point=False):
+    if jump_point:
+        return _worker_planner.planning_jps(*query)
+    return _worker_planner.planning(*query)
+
+
 def main():
     print(__file__ + " start!!")
 
@@ -270,9 +835,12 @@ def main():
         plt.axis("equal")
 
     a_star = AStarPlanner(ox, oy, grid_size, robot_radius)
+    a_star.stats = PlanningStats(trace=show_animation)
     rx, ry = a_star.planning(sx, sy, gx, gy)
+    print(a_star.stats)
 
     if show_animation:  # pragma: no cover
+        a_star.draw_trace(a_star.stats.trace)
         plt.plot(rx, ry, "-r")
         plt.pause(0.001)
         plt.show()
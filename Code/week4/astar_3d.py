@@ -0,0 +1,272 @@
+"""
+
+3D A* voxel grid planning for UAVs
+
+The occupancy is sparse: only the inflated obstacle voxels are stored, as
+a sorted array of int64 voxel indexes, and the search state only covers
+the visited voxels. Memory therefore grows with the obstacle surface and
+the explored volume instead of the bounding box of the map.
+
+"""
+
+import heapq
+import math
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from astar import OBSTACLE_CHUNK_CELLS
+
+show_animation = True
+
+
+class AStarPlanner3D:
+
+    def __init__(self, ox, oy, oz, resolution, rr):
+        """
+        Initialize voxel map for 3D a star planning
+
+        ox: x position list of Obstacles [m]
+        oy: y position list of Obstacles [m]
+        oz: z position list of Obstacles [m]
+        resolution: voxel size [m]
+        rr: robot radius[m]
+        """
+
+        self.resolution = resolution
+        self.rr = rr
+        self.min_x, self.min_y, self.min_z = 0, 0, 0
+        self.max_x, self.max_y, self.max_z = 0, 0, 0
+        self.x_width, self.y_width, self.z_width = 0, 0, 0
+        self.occupied = None  # sorted voxel indexes of inflated obstacles
+        self.n_expanded = 0  # nodes expanded by the last search
+        self.motion = self.get_motion_model()
+        self.calc_obstacle_map(ox, oy, oz)
+
+    def planning(self, sx, sy, sz, gx, gy, gz):
+        """
+        A star path search
+
+        input:
+            sx, sy, sz: start position [m]
+            gx, gy, gz: goal position [m]
+
+        output:
+            rx, ry, rz: position lists of the final path, from the goal,
+                empty if there is none
+        """
+        start = (self.calc_xyz_index(sx, self.min_x),
+                 self.calc_xyz_index(sy, self.min_y),
+                 self.calc_xyz_index(sz, self.min_z))
+        goal = (self.calc_xyz_index(gx, self.min_x),
+                self.calc_xyz_index(gy, self.min_y),
+                self.calc_xyz_index(gz, self.min_z))
+        if not (self.in_grid(*start) and self.in_grid(*goal)):
+            print("Start or goal is outside of the grid..")
+            return [], [], []
+
+        x_width, y_width, z_width = self.x_width, self.y_width, self.z_width
+        occupied = self.occupied
+        motion = self.motion
+        offsets = np.array([dx + (dy + dz * y_width) * x_width
+                            for dx, dy, dz, _ in motion], dtype=np.int64)
+
+        start_id = self.calc_voxel_index(*start)
+        goal_id = self.calc_voxel_index(*goal)
+        goal_x, goal_y, goal_z = goal
+
+        # sparse search state: g cost and parent of the generated voxels
+        cost, parent, closed = {start_id: 0.0}, {start_id: -1}, set()
+        h = math.dist(start, goal)
+        open_heap = [(h, h, start_id)]
+        n_closed = 0
+
+        while True:
+            if len(open_heap) == 0:
+                print("Open set is empty..")
+                break
+
+            _, _, c_id = heapq.heappop(open_heap)
+            if c_id in closed:  # outdated entry
+                continue
+            if c_id == goal_id:
+                print("Find goal")
+                break
+
+            closed.add(c_id)
+            n_closed += 1
+            c_cost = cost[c_id]
+            c_yz, c_x = divmod(c_id, x_width)
+            c_z, c_y = divmod(c_yz, y_width)
+
+            # collision check of all 26 neighbors at once
+            n_ids = c_id + offsets
+            i = np.minimum(np.searchsorted(occupied, n_ids),
+                           occupied.shape[0] - 1)
+            blocked = (occupied[i] == n_ids).tolist() if \
+                occupied.shape[0] else [False] * len(motion)
+
+            for (dx, dy, dz, dc), n_id, n_blocked in zip(
+                    motion, n_ids.tolist(), blocked):
+                x, y, z = c_x + dx, c_y + dy, c_z + dz
+                if n_blocked or x < 0 or y < 0 or z < 0 or x >= x_width or \
+                        y >= y_width or z >= z_width or n_id in closed:
+                    continue
+
+                n_cost = c_cost + dc
+                if n_cost >= cost.get(n_id, math.inf):
+                    continue
+                cost[n_id] = n_cost
+                parent[n_id] = c_id
+
+                h = math.sqrt((goal_x - x) ** 2 + (goal_y - y) ** 2 +
+                              (goal_z - z) ** 2)
+                heapq.heappush(open_heap, (n_cost + h, h, n_id))
+
+        self.n_expanded = n_closed
+        if goal_id not in cost:  # the open set ran empty
+            return [], [], []
+        return self.calc_final_path(goal_id, parent)
+
+    def calc_final_path(self, goal_index, parent):
+        # generate final course
+        rx, ry, rz = [], [], []
+        index = goal_index
+        while index != -1:
+            yz, x = divmod(index, self.x_width)
+            z, y = divmod(yz, self.y_width)
+            rx.append(self.calc_grid_position(x, self.min_x))
+            ry.append(self.calc_grid_position(y, self.min_y))
+            rz.append(self.calc_grid_position(z, self.min_z))
+            index = parent.get(index, -1)
+
+        return rx, ry, rz
+
+    def calc_grid_position(self, index, min_position):
+        return index * self.resolution + min_position
+
+    def calc_xyz_index(self, position, min_pos):
+        return round((position - min_pos) / self.resolution)
+
+    def calc_voxel_index(self, x, y, z):
+        return (z * self.y_width + y) * self.x_width + x
+
+    def in_grid(self, x, y, z):
+        return 0 <= x < self.x_width and 0 <= y < self.y_width and \
+            0 <= z < self.z_width
+
+    def calc_obstacle_map(self, ox, oy, oz):
+
+        self.min_x, self.min_y, self.min_z = (round(min(ox)), round(min(oy)),
+                                              round(min(oz)))
+        self.max_x, self.max_y, self.max_z = (round(max(ox)), round(max(oy)),
+                                              round(max(oz)))
+        print("min:", self.min_x, self.min_y, self.min_z)
+        print("max:", self.max_x, self.max_y, self.max_z)
+
+        self.x_width = round((self.max_x - self.min_x) / self.resolution)
+        self.y_width = round((self.max_y - self.min_y) / self.resolution)
+        self.z_width = round((self.max_z - self.min_z) / self.resolution)
+        print("width:", self.x_width, self.y_width, self.z_width)
+
+        self.occupied = self.calc_inflated_voxels(ox, oy, oz)
+        print("occupied voxels:", self.occupied.shape[0])
+
+    def calc_inflated_voxels(self, ox, oy, oz):
+        """
+        Voxel indexes within robot radius of the obstacles
+
+        Every obstacle stamps a ball of radius rr, checked with the exact
+        distance from the voxel position to the obstacle.
+
+        :return: sorted unique int64 voxel indexes
+        """
+        points = np.stack([np.asarray(ox, dtype=float),
+                           np.asarray(oy, dtype=float),
+                           np.asarray(oz, dtype=float)], axis=1)
+        min_position = np.array([self.min_x, self.min_y, self.min_z],
+                                dtype=float)
+        widths = np.array([self.x_width, self.y_width, self.z_width])
+
+        # ball stamp offsets around the lowest index the ball can reach,
+        # one voxel of margin against rounding at the ball boundary
+        span = int(math.floor(2.0 * self.rr / self.resolution)) + 3
+        offsets = np.stack(np.meshgrid(*[np.arange(span)] * 3,
+                                       indexing="ij"), axis=-1).reshape(-1, 3)
+
+        keys = []
+        chunk = max(OBSTACLE_CHUNK_CELLS // offsets.shape[0], 1)
+        for i in range(0, points.shape[0], chunk):
+            c = points[i:i + chunk, np.newaxis, :]
+            index = np.ceil((c - self.rr - min_position) /
+                            self.resolution).astype(np.int64) - 1 + offsets
+            position = index * self.resolution + min_position
+            hit = ((np.linalg.norm(c - position, axis=2) <= self.rr) &
+                   np.all((index >= 0) & (index < widths), axis=2))
+            index = index[hit]
+            keys.append(self.calc_voxel_index(index[:, 0], index[:, 1],
+                                              index[:, 2]))
+
+        if not keys:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(keys))
+
+    @staticmethod
+    def get_motion_model():
+        # dx, dy, dz, cost: the 26 neighbors of a voxel
+        motion = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for dz in (-1, 0, 1):
+                    if dx or dy or dz:
+                        motion.append([dx, dy, dz,
+                                       math.sqrt(dx * dx + dy * dy + dz * dz)])
+
+        return motion
+
+
+def main():
+    print(__file__ + " start!!")
+
+    # start and goal position
+    sx, sy, sz = 10.0, 10.0, 5.0  # [m]
+    gx, gy, gz = 50.0, 50.0, 15.0  # [m]
+    grid_size = 2.0  # [m]
+    robot_radius = 1.0  # [m]
+
+    # set obstacle positions: ground, ceiling and two walls with a window
+    ox, oy, oz = [], [], []
+    for i in range(-10, 61, 2):
+        for j in range(-10, 61, 2):
+            for k in (-10.0, 30.0):
+                ox.append(float(i))
+                oy.append(float(j))
+                oz.append(k)
+    for j in range(-10, 61):
+        for k in range(-10, 31):
+            if not (20 <= j < 30 and 0 <= k < 10):
+                ox.append(20.0)
+                oy.append(float(j))
+                oz.append(float(k))
+            if not (40 <= j < 50 and 15 <= k < 25):
+                ox.append(40.0)
+                oy.append(float(j))
+                oz.append(float(k))
+
+    a_star = AStarPlanner3D(ox, oy, oz, grid_size, robot_radius)
+    rx, ry, rz = a_star.planning(sx, sy, sz, gx, gy, gz)
+    print("expanded nodes:", a_star.n_expanded)
+
+    if show_animation:  # pragma: no cover
+        ax = plt.figure().add_subplot(projection="3d")
+        walls = np.array(oz) > -10.0
+        ax.scatter(np.array(ox)[walls], np.array(oy)[walls],
+                   np.array(oz)[walls], c="k", s=1, alpha=0.1)
+        ax.plot(sx, sy, sz, "og")
+        ax.plot(gx, gy, gz, "xb")
+        ax.plot(rx, ry, rz, "-r")
+        plt.show()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,369 @@
+"""
+
+D* Lite grid planning
+
+Incremental replanning on the grid and motion model of AStarPlanner. The
+search runs backward from the goal, so when obstacles are added or removed,
+or the robot moves, only the cells whose cost-to-goal changed are expanded
+again instead of searching the whole map from scratch.
+
+See S. Koenig and M. Likhachev, "D* Lite", AAAI 2002
+
+"""
+
+import heapq
+import math
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from astar import AStarPlanner, PlanningStats
+
+show_animation = True
+
+
+class DStarLitePlanner(AStarPlanner):
+
+    def __init__(self, ox, oy, resolution, rr):
+        """
+        Initialize grid map for D* Lite planning
+
+        ox: x position list of Obstacles [m], also sets the map extent
+        oy: y position list of Obstacles [m]
+        resolution: grid resolution [m]
+        rr: robot radius[m]
+        """
+        super().__init__(ox, oy, resolution, rr)
+
+        # number of inflated obstacles covering every cell, so removing an
+        # obstacle only frees the cells no other obstacle covers
+        self.obstacle_count = np.zeros((self.x_width, self.y_width),
+                                       dtype=np.int32, order="F")
+        np.add.at(self.obstacle_count, self.calc_inflated_cells(ox, oy), 1)
+
+        # dx, dy, cost, flat index offset
+        self.neighbors = [(dx, dy, dc, dy * self.x_width + dx)
+                          for dx, dy, dc in self.motion]
+
+        self.start_id, self.goal_id = -1, -1
+        self.km = 0.0  # key modifier, heuristic drift of the moving start
+        self.g, self.rhs = None, None
+        self.open_heap, self.open_keys = [], dict()
+
+    def planning(self, sx, sy, gx, gy):
+        """
+        D* Lite path search
+
+        The first call and every call with a new goal search from scratch.
+        Later calls with the same goal repair the previous search after
+        the obstacle changes and the start movement since then.
+
+        input:
+            s_x: start x position [m]
+            s_y: start y position [m]
+            gx: goal x position [m]
+            gy: goal y position [m]
+
+        output:
+            rx: x position list of the final path, from the goal, empty if
+                there is none
+            ry: y position list of the final path, from the goal, empty if
+                there is none
+        """
+        start_node = self.Node(self.calc_xy_index(sx, self.min_x),
+                               self.calc_xy_index(sy, self.min_y), 0.0, -1)
+        goal_node = self.Node(self.calc_xy_index(gx, self.min_x),
+                              self.calc_xy_index(gy, self.min_y), 0.0, -1)
+        if not (self.in_grid(start_node) and self.in_grid(goal_node)):
+            print("Start or goal is outside of the grid..")
+            return [], []
+
+        stats = self.stats
+        if stats is not None:
+            search_start = time.perf_counter()
+
+        start_id = self.calc_grid_index(start_node)
+        goal_id = self.calc_grid_index(goal_node)
+        if goal_id != self.goal_id:
+            self.initialize(start_id, goal_id)
+        elif start_id != self.start_id:
+            self.km += self.calc_index_heuristic(self.start_id, start_id)
+            self.start_id = start_id
+
+        self.compute_shortest_path()
+
+        if stats is None:
+            return self.calc_final_path()
+        path_start = time.perf_counter()
+        rx, ry = self.calc_final_path()
+        stats.map_time = self.map_time
+        stats.search_time = path_start - search_start
+        stats.path_time = time.perf_counter() - path_start
+        return rx, ry
+
+    def initialize(self, start_id, goal_id):
+        n_cells = self.x_width * self.y_width
+        self.start_id, self.goal_id = start_id, goal_id
+        self.km = 0.0
+        self.g = np.full(n_cells, np.inf)
+        self.rhs = np.full(n_cells, np.inf)
+        self.rhs[goal_id] = 0.0
+        self.open_heap, self.open_keys = [], dict()
+        self.push(goal_id, (self.calc_index_heuristic(start_id, goal_id), 0.0))
+
+    def add_obstacles(self, ox, oy):
+        """
+        Add obstacles, the next planning call repairs the search
+
+        ox: x position list of the new Obstacles [m]
+        oy: y position list of the new Obstacles [m]
+        """
+        self.update_obstacles(ox, oy, 1)
+
+    def remove_obstacles(self, ox, oy):
+        """
+        Remove previously added obstacles
+
+        ox: x position list of the removed Obstacles [m]
+        oy: y position list of the removed Obstacles [m]
+        """
+        self.update_obstacles(ox, oy, -1)
+
+    def update_obstacles(self, ox, oy, delta):
+        ix, iy = self.calc_inflated_cells(ox, oy)
+        np.add.at(self.obstacle_count, (ix, iy), delta)
+        cells = np.unique(iy * self.x_width + ix)
+        cx, cy = cells % self.x_width, cells // self.x_width
+        blocked = self.obstacle_count[cx, cy] > 0
+        changed = blocked != self.obstacle_map[cx, cy]
+        cx, cy = cx[changed], cy[changed]
+        self.obstacle_map[cx, cy] = blocked[changed]
+        print("changed cells:", cx.shape[0])
+
+        if self.g is None or cx.shape[0] == 0:
+            return
+        # a cell only changes the cost of the edges entering it, so the
+        # cells next to it need their rhs recomputed
+        affected = set()
+        for dx, dy, _, _ in self.neighbors:
+            nx, ny = cx - dx, cy - dy
+            inside = ((nx >= 0) & (nx < self.x_width) &
+                      (ny >= 0) & (ny < self.y_width))
+            affected.update((ny[inside] * self.x_width + nx[inside]).tolist())
+        rhs = self.rhs
+        for u in affected:
+            if u != self.goal_id:
+                rhs[u] = self.calc_rhs(u)
+            self.update_vertex(u)
+
+    def compute_shortest_path(self):
+        g, rhs = memoryview(self.g), memoryview(self.rhs)
+        blocked = memoryview(self.obstacle_map.ravel(order="F"))
+        width, height = self.x_width, self.y_width
+        start_id, goal_id = self.start_id, self.goal_id
+        n_expanded = 0
+        stats = self.stats
+        trace = [] if stats is not None and stats.trace_enabled else None
+
+        while True:
+            k_old, u = self.top()
+            g_start, rhs_start = g[start_id], rhs[start_id]
+            m = min(g_start, rhs_start)
+            if not (k_old < (m + self.km, m) or rhs_start > g_start):
+                break
+            n_expanded += 1
+
+            k_new = self.calc_key(u)
+            if k_old < k_new:
+                self.push(u, k_new)
+                continue
+
+            u_y, u_x = divmod(u, width)
+            if trace is not None:
+                trace.append(u)
+
+            if g[u] > rhs[u]:
+                # locally overconsistent, the cost-to-goal decreased
+                g_u = g[u] = rhs[u]
+                del self.open_keys[u]
+                if blocked[u]:  # no edges enter a blocked cell
+                    continue
+                for dx, dy, dc, offset in self.neighbors:
+                    x, y = u_x - dx, u_y - dy
+                    if x < 0 or y < 0 or x >= width or y >= height:
+                        continue
+                    s = u - offset
+                    if s != goal_id and g_u + dc < rhs[s]:
+                        rhs[s] = g_u + dc
+                        self.update_vertex(s)
+            else:
+                # underconsistent, the cost-to-goal increased
+                g_old = g[u]
+                g[u] = math.inf
+                predecessors = [u]
+                if not blocked[u]:
+                    for dx, dy, dc, offset in self.neighbors:
+                        x, y = u_x - dx, u_y - dy
+                        if 0 <= x < width and 0 <= y < height and \
+                                rhs[u - offset] == g_old + dc:
+                            predecessors.append(u - offset)
+                for s in predecessors:
+                    if s != goal_id:
+                        rhs[s] = self.calc_rhs(s)
+                    self.update_vertex(s)
+
+        self.n_expanded = n_expanded
+        if stats is not None:
+            # the lazy heap has no counters of its own to report, the
+            # generated and heap counters stay None
+            stats.expanded = n_expanded
+            stats.trace = None if trace is None else np.array(
+                trace, dtype=np.int64)
+
+    def calc_rhs(self, s):
+        # one step lookahead: best cost-to-goal through a neighbor
+        g = self.g
+        blocked = self.obstacle_map
+        s_y, s_x = divmod(s, self.x_width)
+        best = math.inf
+        for dx, dy, dc, offset in self.neighbors:
+            x, y = s_x + dx, s_y + dy
+            if 0 <= x < self.x_width and 0 <= y < self.y_width and \
+                    not blocked[x, y]:
+                best = min(best, g[s + offset] + dc)
+        return best
+
+    def update_vertex(self, u):
+        if self.g[u] != self.rhs[u]:
+            self.push(u, self.calc_key(u))
+        elif u in self.open_keys:
+            del self.open_keys[u]
+
+    def calc_key(self, s):
+        m = min(self.g[s], self.rhs[s])
+        return m + self.calc_index_heuristic(self.start_id, s) + self.km, m
+
+    def push(self, u, key):
+        # lazy priority update: outdated heap entries are skipped in top()
+        self.open_keys[u] = key
+        heapq.heappush(self.open_heap, (key[0], key[1], u))
+
+    def top(self):
+        heap = self.open_heap
+        while heap:
+            k1, k2, u = heap[0]
+            if self.open_keys.get(u) == (k1, k2):
+                return (k1, k2), u
+            heapq.heappop(heap)
+        return (math.inf, math.inf), -1
+
+    def calc_index_heuristic(self, a, b):
+        a_y, a_x = divmod(a, self.x_width)
+        b_y, b_x = divmod(b, self.x_width)
+        return math.hypot(a_x - b_x, a_y - b_y)
+
+    def calc_final_path(self):
+        # follow the best neighbor from the start down to the goal, the
+        # start itself may be left overconsistent so its rhs is the cost
+        if math.isinf(self.rhs[self.start_id]):
+            print("No path..")
+            return [], []
+        print("Find goal")
+
+        blocked = self.obstacle_map
+        index = self.start_id
+        path = [index]
+        while index != self.goal_id:
+            y, x = divmod(index, self.x_width)
+            best, best_index = math.inf, -1
+            for dx, dy, dc, offset in self.neighbors:
+                nx, ny = x + dx, y + dy
+                if 0 <= nx < self.x_width and 0 <= ny < self.y_width and \
+                        not blocked[nx, ny] and \
+                        self.g[index + offset] + dc < best:
+                    best, best_index = self.g[index + offset] + dc, \
+                        index + offset
+            if best_index == -1:
+                print("No path..")
+                return [], []
+            index = best_index
+            path.append(index)
+
+        rx, ry = [], []
+        for index in reversed(path):
+            y, x = divmod(index, self.x_width)
+            rx.append(self.calc_grid_position(x, self.min_x))
+            ry.append(self.calc_grid_position(y, self.min_y))
+        return rx, ry
+
+
+def main():
+    print(__file__ + " start!!")
+
+    # start and goal position
+    sx = 10.0  # [m]
+    sy = 10.0  # [m]
+    gx = 50.0  # [m]
+    gy = 50.0  # [m]
+    grid_size = 2.0  # [m]
+    robot_radius = 1.0  # [m]
+
+    # set obstacle positions
+    ox, oy = [], []
+    for i in range(-10, 60):
+        ox.append(i)
+        oy.append(-10.0)
+    for i in range(-10, 60):
+        ox.append(60.0)
+        oy.append(i)
+    for i in range(-10, 61):
+        ox.append(i)
+        oy.append(60.0)
+    for i in range(-10, 61):
+        ox.append(-10.0)
+        oy.append(i)
+    for i in range(-10, 40):
+        ox.append(20.0)
+        oy.append(i)
+    for i in range(0, 40):
+        ox.append(40.0)
+        oy.append(60.0 - i)
+
+    # wall that appears after the first plan
+    nx, ny = [], []
+    for i in range(10, 45):
+        nx.append(30.0)
+        ny.append(i)
+
+    if show_animation:  # pragma: no cover
+        plt.plot(ox, oy, ".k")
+        plt.plot(sx, sy, "og")
+        plt.plot(gx, gy, "xb")
+        plt.grid(True)
+        plt.axis("equal")
+
+    d_star = DStarLitePlanner(ox, oy, grid_size, robot_radius)
+    d_star.stats = PlanningStats(trace=show_animation)
+    rx, ry = d_star.planning(sx, sy, gx, gy)
+    print("expanded nodes:", d_star.n_expanded)
+
+    if show_animation:  # pragma: no cover
+        d_star.draw_trace(d_star.stats.trace)
+        plt.plot(rx, ry, "-r")
+        plt.plot(nx, ny, ".m")
+        plt.pause(0.001)
+
+    d_star.add_obstacles(nx, ny)
+    rx, ry = d_star.planning(sx, sy, gx, gy)
+    print("expanded nodes after replanning:", d_star.n_expanded)
+
+    if show_animation:  # pragma: no cover
+        d_star.draw_trace(d_star.stats.trace)
+        plt.plot(rx, ry, "-b")
+        plt.pause(0.001)
+        plt.show()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,11 @@
+import heapq
+import time
+from collections import deque
+
 import numpy as np
 import matplotlib.pyplot as plt
+from scipy.linalg import cho_factor, cho_solve, solve_triangular
+from scipy.linalg.lapack import dpotrf, dpotrs
 
 # Define the state transition function
 def f(state, dt):
@@ -55,45 +61,622 @@ class EKF:
         self.state += K @ y
         self.P = (np.eye(self.state_dim) - K @ H) @ self.P
 
-# Simulate GPS and IMU data
-np.random.seed(42)
-dt = 0.1
-time_steps = 100
-
-true_states = []
-gps_measurements = []
-imu_measurements = []
-
-state = np.array([0, 0, 1, 1])
-for t in range(time_steps):
-    true_states.append(state.copy())
-    gps_measurements.append(h_gps(state) + np.random.randn(2) * 0.5)
-    imu_measurements.append(h_imu(state) + np.random.randn(2) * 0.1)
-    state = f(state, dt)
-
-true_states = np.array(true_states)
-gps_measurements = np.array(gps_measurements)
-imu_measurements = np.array(imu_measurements)
-
-# Apply EKF to fuse GPS and IMU data
-ekf = EKF(state_dim=4, obs_dim_gps=2, obs_dim_imu=2)
-estimated_states = []
-
-for t in range(time_steps):
-    ekf.predict(dt)
-    ekf.update_gps(gps_measurements[t])
-    ekf.update_imu(imu_measurements[t])
-    estimated_states.append(ekf.state.copy())
-
-estimated_states = np.array(estimated_states)
-
-# Plot the results
-plt.figure(figsize=(10, 6))
-plt.plot(true_states[:, 0], true_states[:, 1], label='True Position')
-plt.scatter(gps_measurements[:, 0], gps_measurements[:, 1], label='GPS Measurements', color='r', s=10)
-plt.plot(estimated_states[:, 0], estimated_states[:, 1], label='Estimated Position (EKF)', linestyle='--')
-plt.xlabel('X Position')
-plt.ylabel('Y Position')
-plt.legend()
-plt.title('GPS/IMU Fusion using EKF')
-plt.show()
+# Extended Kalman Filter without allocations in the filter step
+class FastEKF:
+    """
+    The EKF above with the Jacobians and scratch buffers allocated once.
+    F is updated in place when dt changes, S is solved by Cholesky instead
+    of inverted, and P is updated in Joseph form, which keeps it symmetric
+    positive definite.
+    """
+    def __init__(self, state_dim=4, obs_dim_gps=2, obs_dim_imu=2):
+        self.state_dim = state_dim
+        self.state = np.zeros(state_dim)
+        self.P = np.eye(state_dim)
+        self.Q = np.eye(state_dim) * 0.1  # Process noise covariance
+        self.R_gps = np.eye(obs_dim_gps) * 0.5  # GPS measurement noise covariance
+        self.R_imu = np.eye(obs_dim_imu) * 0.1  # IMU measurement noise covariance
+        # h_gps and h_imu are linear, so their Jacobians are constant
+        self.H_gps = np.zeros((obs_dim_gps, state_dim))
+        self.H_gps[0, 0] = 1
+        self.H_gps[1, 1] = 1
+        self.H_imu = np.zeros((obs_dim_imu, state_dim))
+        self.H_imu[0, 2] = 1
+        self.H_imu[1, 3] = 1
+        self.H_gps_T = np.ascontiguousarray(self.H_gps.T)
+        self.H_imu_T = np.ascontiguousarray(self.H_imu.T)
+
+        self.dt = 0.0
+        self.F = np.eye(state_dim)
+        self.F_T = np.eye(state_dim)
+        self.I = np.eye(state_dim)
+        # scratch buffers of the filter step
+        self.x_buffer = np.empty(state_dim)
+        self.P_buffer = np.empty((state_dim, state_dim))
+        self.KRKt = np.empty((state_dim, state_dim))
+        self.IKH = np.empty((state_dim, state_dim))
+        self.buffers = {}
+        for obs_dim in {obs_dim_gps, obs_dim_imu}:
+            self.buffers[obs_dim] = (
+                np.empty(obs_dim),  # innovation
+                np.empty((state_dim, obs_dim)),  # P H^T
+                # Fortran order lets LAPACK work in place: S is factored
+                # into its Cholesky factor and K^T is solved over H P
+                np.empty((obs_dim, obs_dim), order='F'),  # S
+                np.empty((obs_dim, state_dim), order='F'),  # K^T
+                np.empty((state_dim, obs_dim)))  # K R
+
+    def predict(self, dt):
+        if dt != self.dt:
+            self.F[0, 2] = self.F_T[2, 0] = dt
+            self.F[1, 3] = self.F_T[3, 1] = dt
+            self.dt = dt
+        np.matmul(self.F, self.state, out=self.x_buffer)
+        self.state[:] = self.x_buffer
+        np.matmul(self.F, self.P, out=self.P_buffer)
+        np.matmul(self.P_buffer, self.F_T, out=self.P)
+        self.P += self.Q
+
+    def update_gps(self, z):
+        self.update(z, self.H_gps, self.H_gps_T, self.R_gps)
+
+    def update_imu(self, z):
+        self.update(z, self.H_imu, self.H_imu_T, self.R_imu)
+
+    def update(self, z, H, H_T, R):
+        y, PHt, S, Kt, KR = self.buffers[H.shape[0]]
+        np.matmul(H, self.state, out=y)
+        np.subtract(z, y, out=y)
+        np.matmul(self.P, H_T, out=PHt)
+        np.matmul(H, PHt, out=S)
+        S += R
+        # K = P H^T S^-1, from S K^T = H P as S and P are symmetric. The
+        # LAPACK routines are called directly, the checks of cho_factor and
+        # cho_solve cost more than the solve itself at this size
+        L, info = dpotrf(S, lower=1, clean=0, overwrite_a=1)
+        if info != 0:
+            raise np.linalg.LinAlgError("innovation covariance is not positive definite")
+        Kt[:] = PHt.T
+        # overwrite_b is only a permission, use the returned solution
+        Kt, info = dpotrs(L, Kt, lower=1, overwrite_b=1)
+        if info != 0:
+            raise np.linalg.LinAlgError("Kalman gain solve failed")
+        K = Kt.T
+        np.matmul(K, y, out=self.x_buffer)
+        self.state += self.x_buffer
+        # Joseph form: P = (I - K H) P (I - K H)^T + K R K^T
+        np.matmul(K, H, out=self.IKH)
+        np.subtract(self.I, self.IKH, out=self.IKH)
+        np.matmul(self.IKH, self.P, out=self.P_buffer)
+        np.matmul(self.P_buffer, self.IKH.T, out=self.P)
+        np.matmul(K, R, out=KR)
+        np.matmul(KR, Kt, out=self.KRKt)
+        self.P += self.KRKt
+
+# Square-root Extended Kalman Filter
+class SquareRootEKF:
+    """
+    The EKF above propagating a lower triangular factor S of P = S S^T
+    instead of P. Both steps are QR factorisations of a stacked array, so
+    P stays symmetric positive semidefinite by construction and the
+    factor needs only half the precision range of P.
+    """
+    def __init__(self, state_dim=4, obs_dim_gps=2, obs_dim_imu=2):
+        self.state_dim = state_dim
+        self.state = np.zeros(state_dim)
+        self.S = np.eye(state_dim)  # P = S S^T
+        self.Q = np.eye(state_dim) * 0.1  # Process noise covariance
+        self.R_gps = np.eye(obs_dim_gps) * 0.5  # GPS measurement noise covariance
+        self.R_imu = np.eye(obs_dim_imu) * 0.1  # IMU measurement noise covariance
+        # h_gps and h_imu are linear, so their Jacobians are constant
+        self.H_gps = np.zeros((obs_dim_gps, state_dim))
+        self.H_gps[0, 0] = 1
+        self.H_gps[1, 1] = 1
+        self.H_imu = np.zeros((obs_dim_imu, state_dim))
+        self.H_imu[0, 2] = 1
+        self.H_imu[1, 3] = 1
+
+    @property
+    def P(self):
+        return self.S @ self.S.T
+
+    @P.setter
+    def P(self, P):
+        self.S = np.linalg.cholesky(P)
+
+    def predict(self, dt):
+        F = np.eye(self.state_dim)
+        F[0, 2] = dt
+        F[1, 3] = dt
+        self.state = F @ self.state
+        # [F S, Q^1/2] [F S, Q^1/2]^T = F P F^T + Q = R^T R
+        A = np.hstack([F @ self.S, np.linalg.cholesky(self.Q)])
+        self.S = np.linalg.qr(A.T, mode='r').T
+
+    def update_gps(self, z):
+        self.update(z, self.H_gps, self.R_gps)
+
+    def update_imu(self, z):
+        self.update(z, self.H_imu, self.R_imu)
+
+    def update(self, z, H, R):
+        m, n = H.shape
+        # lower triangularise [[R^1/2, H S], [0, S]] to
+        # [[S_y^1/2, 0], [K S_y^1/2, S+]], S_y the innovation covariance
+        M = np.zeros((m + n, m + n))
+        M[:m, :m] = np.linalg.cholesky(R)
+        M[:m, m:] = H @ self.S
+        M[m:, m:] = self.S
+        L = np.linalg.qr(M.T, mode='r').T
+        # K = (K S_y^1/2) S_y^-1/2, solved as S_y^T/2 K^T = (K S_y^1/2)^T
+        K = solve_triangular(L[:m, :m], L[m:, :m].T, lower=True,
+                             trans='T').T
+        self.state = self.state + K @ (z - H @ self.state)
+        self.S = L[m:, m:]
+
+# Information form Extended Kalman Filter
+class InformationEKF:
+    """
+    The EKF above keeping the information matrix Y = P^-1 and vector
+    y = P^-1 x. An update only adds H^T R^-1 H and H^T R^-1 z, so any
+    number of simultaneous observations is fused by one sum, see
+    update_many(). state and P are computed on access.
+    """
+    def __init__(self, state_dim=4, obs_dim_gps=2, obs_dim_imu=2):
+        self.state_dim = state_dim
+        self.Y = np.eye(state_dim)  # information matrix, P^-1
+        self.y = np.zeros(state_dim)  # information vector, P^-1 x
+        self.Q = np.eye(state_dim) * 0.1  # Process noise covariance
+        self.R_gps = np.eye(obs_dim_gps) * 0.5  # GPS measurement noise covariance
+        self.R_imu = np.eye(obs_dim_imu) * 0.1  # IMU measurement noise covariance
+        # h_gps and h_imu are linear, so their Jacobians are constant
+        self.H_gps = np.zeros((obs_dim_gps, state_dim))
+        self.H_gps[0, 0] = 1
+        self.H_gps[1, 1] = 1
+        self.H_imu = np.zeros((obs_dim_imu, state_dim))
+        self.H_imu[0, 2] = 1
+        self.H_imu[1, 3] = 1
+
+    @property
+    def state(self):
+        return cho_solve(cho_factor(self.Y), self.y)
+
+    @state.setter
+    def state(self, state):
+        self.y = self.Y @ state
+
+    @property
+    def P(self):
+        return cho_solve(cho_factor(self.Y), np.eye(self.state_dim))
+
+    @P.setter
+    def P(self, P):
+        state = self.state
+        self.Y = cho_solve(cho_factor(P), np.eye(self.state_dim))
+        self.y = self.Y @ state
+
+    def predict(self, dt):
+        # the prediction is a covariance step, done through P
+        F = np.eye(self.state_dim)
+        F[0, 2] = dt
+        F[1, 3] = dt
+        state = F @ self.state
+        P = F @ self.P @ F.T + self.Q
+        Y = cho_solve(cho_factor(P), np.eye(self.state_dim))
+        self.Y = (Y + Y.T) / 2
+        self.y = self.Y @ state
+
+    def update_gps(self, z):
+        self.update(z, self.H_gps, self.R_gps)
+
+    def update_imu(self, z):
+        self.update(z, self.H_imu, self.R_imu)
+
+    def update(self, z, H, R):
+        HtRinv = cho_solve(cho_factor(R), H).T
+        self.Y += HtRinv @ H
+        self.y += HtRinv @ z
+
+    def update_many(self, z, H, R):
+        """
+        Fuse k simultaneous observations at once
+
+        z: (k, m) observations
+        H: (m, n) or (k, m, n) observation Jacobians
+        R: (m, m) or (k, m, m) observation noise covariances
+        """
+        z = np.asarray(z, dtype=float)
+        H = np.broadcast_to(H, (z.shape[0],) + np.shape(H)[-2:])
+        R = np.broadcast_to(R, (z.shape[0],) + np.shape(R)[-2:])
+        RinvH = np.linalg.solve(R, H)
+        self.Y += np.einsum('kmi,kmj->ij', H, RinvH)
+        self.y += np.einsum('kmi,km->i', RinvH, z)
+
+# Extended Kalman Filter for N tracks at once
+class BatchEKF:
+    """
+    The EKF above for n_tracks vehicles, with states stacked as (N, 4) and
+    covariances as (N, 4, 4). Every call runs as one vectorized operation
+    over all tracks. Tracks without a measurement are masked out of the
+    update, or marked with NaN rows in z.
+    """
+    def __init__(self, n_tracks, state_dim=4, obs_dim_gps=2, obs_dim_imu=2):
+        self.n_tracks = n_tracks
+        self.state_dim = state_dim
+        self.state = np.zeros((n_tracks, state_dim))
+        self.P = np.tile(np.eye(state_dim), (n_tracks, 1, 1))
+        self.Q = np.eye(state_dim) * 0.1  # Process noise covariance
+        self.R_gps = np.eye(obs_dim_gps) * 0.5  # GPS measurement noise covariance
+        self.R_imu = np.eye(obs_dim_imu) * 0.1  # IMU measurement noise covariance
+        # h_gps and h_imu are linear, so their Jacobians are constant
+        self.H_gps = np.zeros((obs_dim_gps, state_dim))
+        self.H_gps[0, 0] = 1
+        self.H_gps[1, 1] = 1
+        self.H_imu = np.zeros((obs_dim_imu, state_dim))
+        self.H_imu[0, 2] = 1
+        self.H_imu[1, 3] = 1
+
+    def predict(self, dt, mask=None):
+        """
+        dt: time step, scalar or (N,) per track
+        mask: (N,) bool, tracks to predict, default all
+        """
+        dt = np.broadcast_to(np.asarray(dt, dtype=float), (self.n_tracks,))
+        idx = slice(None) if mask is None else np.flatnonzero(mask)
+        F = np.tile(np.eye(self.state_dim), (dt[idx].shape[0], 1, 1))
+        F[:, 0, 2] = dt[idx]
+        F[:, 1, 3] = dt[idx]
+        self.state[idx] = np.einsum('nij,nj->ni', F, self.state[idx])
+        self.P[idx] = np.einsum('nij,njk,nlk->nil', F, self.P[idx], F) + self.Q
+
+    def update_gps(self, z, mask=None):
+        """
+        z: (N, 2) GPS positions
+        mask: (N,) bool, tracks with a measurement, default rows without NaN
+        """
+        self.update(z, self.H_gps, self.R_gps, mask)
+
+    def update_imu(self, z, mask=None):
+        """
+        z: (N, 2) IMU velocities
+        mask: (N,) bool, tracks with a measurement, default rows without NaN
+        """
+        self.update(z, self.H_imu, self.R_imu, mask)
+
+    def update(self, z, H, R, mask=None):
+        z = np.asarray(z, dtype=float)
+        if mask is None:
+            mask = ~np.isnan(z).any(axis=1)
+        idx = np.flatnonzero(mask)
+        if idx.shape[0] == 0:
+            return
+        P = self.P[idx]
+        PHt = np.einsum('nij,kj->nik', P, H)
+        S = np.einsum('ij,njk->nik', H, PHt) + R
+        # K = P H^T S^-1, from S K^T = H P as S and P are symmetric
+        K = np.linalg.solve(S, PHt.transpose(0, 2, 1)).transpose(0, 2, 1)
+        y = z[idx] - self.state[idx] @ H.T
+        self.state[idx] += np.einsum('nij,nj->ni', K, y)
+        self.P[idx] = P - np.einsum('nij,njk->nik', K, PHt.transpose(0, 2, 1))
+
+# Event driven fusion of asynchronous multi-rate sensors
+class FusionScheduler:
+    """
+    Measurements are queued by timestamp and fused in time order. Before
+    every update the filter is predicted to the measurement timestamp.
+    Measurements older than the filter time, e.g. GPS fixes arriving with
+    latency after newer IMU samples, roll the filter back to a state kept
+    in a bounded history and replay the later measurements. IMU samples
+    are accumulated and fused as one update with R / n once imu_window
+    seconds are covered or another sensor is fused, see flush().
+
+    ekf: filter with predict(dt) and an update_<sensor>(z) per sensor
+    history: number of fused updates kept for out-of-sequence measurements
+    """
+    def __init__(self, ekf, t0=0.0, history=100, imu_window=0.05):
+        self.ekf = ekf
+        self.t = t0
+        self.imu_window = imu_window
+        self.queue = []
+        self.seq = 0  # tie breaker of equal timestamps, keeps arrival order
+        self.imu_pending = None  # [t_first, t_sum, z_sum, n]
+        # (t, sensor, z, n, t_before, state_before, P_before) per update
+        self.history = deque(maxlen=history)
+        self.n_measurements = 0
+        self.n_updates = 0
+        self.n_out_of_sequence = 0
+        self.n_replayed = 0
+        self.n_dropped = 0
+
+    def push(self, t, sensor, z):
+        heapq.heappush(self.queue, (t, self.seq, sensor, z))
+        self.seq += 1
+        self.n_measurements += 1
+
+    def process(self, until=np.inf):
+        # fuse the queued measurements up to time until
+        queue = self.queue
+        while queue and queue[0][0] <= until:
+            t, _, sensor, z = heapq.heappop(queue)
+            pending = self.imu_pending
+            if sensor == 'imu' and self.imu_window > 0:
+                if pending is not None and t > pending[0] + self.imu_window:
+                    self.flush()
+                    pending = None
+                if pending is None:
+                    self.imu_pending = [t, t, np.array(z, dtype=float), 1]
+                else:
+                    pending[1] += t
+                    pending[2] += z
+                    pending[3] += 1
+                continue
+            if pending is not None:
+                self.flush()
+            if t < self.t:
+                self.fuse_out_of_sequence(t, sensor, z)
+            else:
+                self.fuse(t, sensor, z)
+
+    def flush(self):
+        # fuse the accumulated IMU samples as their mean at the mean time
+        if self.imu_pending is None:
+            return
+        _, t_sum, z_sum, n = self.imu_pending
+        self.imu_pending = None
+        t, z = t_sum / n, z_sum / n
+        if t < self.t:
+            self.fuse_out_of_sequence(t, 'imu', z, n)
+        else:
+            self.fuse(t, 'imu', z, n)
+
+    def fuse(self, t, sensor, z, n=1):
+        ekf = self.ekf
+        self.history.append((t, sensor, z, n, self.t, ekf.state.copy(),
+                             ekf.P.copy()))
+        if t > self.t:
+            ekf.predict(t - self.t)
+            self.t = t
+        if n == 1:
+            getattr(ekf, 'update_' + sensor)(z)
+        else:
+            # the mean of n independent samples has 1/n of the noise
+            R = getattr(ekf, 'R_' + sensor)
+            setattr(ekf, 'R_' + sensor, R / n)
+            try:
+                getattr(ekf, 'update_' + sensor)(z)
+            finally:
+                setattr(ekf, 'R_' + sensor, R)
+        self.n_updates += 1
+
+    def fuse_out_of_sequence(self, t, sensor, z, n=1):
+        self.n_out_of_sequence += 1
+        history = self.history
+        i = len(history)
+        while i > 0 and history[i - 1][0] > t:
+            i -= 1
+        if i == len(history) or history[i][4] > t:
+            # older than the history reaches back
+            self.n_dropped += 1
+            return
+
+        # roll back to the state before the first later update
+        _, _, _, _, self.t, state, P = history[i]
+        # assigned, not copied in place, so filters that derive state and
+        # P from other quantities can take them through properties
+        self.ekf.state, self.ekf.P = state, P
+        replay = [history.pop() for _ in range(len(history) - i)]
+        self.fuse(t, sensor, z, n)
+        for t_r, sensor_r, z_r, n_r, _, _, _ in reversed(replay):
+            self.fuse(t_r, sensor_r, z_r, n_r)
+        self.n_replayed += len(replay)
+
+def main():
+    # Simulate GPS and IMU data
+    np.random.seed(42)
+    dt = 0.1
+    time_steps = 100
+
+    true_states = []
+    gps_measurements = []
+    imu_measurements = []
+
+    state = np.array([0, 0, 1, 1])
+    for t in range(time_steps):
+        true_states.append(state.copy())
+        gps_measurements.append(h_gps(state) + np.random.randn(2) * 0.5)
+        imu_measurements.append(h_imu(state) + np.random.randn(2) * 0.1)
+        state = f(state, dt)
+
+    true_states = np.array(true_states)
+    gps_measurements = np.array(gps_measurements)
+    imu_measurements = np.array(imu_measurements)
+
+    # Apply EKF to fuse GPS and IMU data
+    ekf = EKF(state_dim=4, obs_dim_gps=2, obs_dim_imu=2)
+    estimated_states = []
+
+    for t in range(time_steps):
+        ekf.predict(dt)
+        ekf.update_gps(gps_measurements[t])
+        ekf.update_imu(imu_measurements[t])
+        estimated_states.append(ekf.state.copy())
+
+    estimated_states = np.array(estimated_states)
+
+    # Plot the results
+    plt.figure(figsize=(10, 6))
+    plt.plot(true_states[:, 0], true_states[:, 1], label='True Position')
+    plt.scatter(gps_measurements[:, 0], gps_measurements[:, 1], label='GPS Measurements', color='r', s=10)
+    plt.plot(estimated_states[:, 0], estimated_states[:, 1], label='Estimated Position (EKF)', linestyle='--')
+    plt.xlabel('X Position')
+    plt.ylabel('Y Position')
+    plt.legend()
+    plt.title('GPS/IMU Fusion using EKF')
+    plt.show()
+
+def main_batch(n_tracks=5000, gps_dropout=0.2):
+    # Simulate a fleet, GPS fixes are missing at random
+    rng = np.random.default_rng(42)
+    dt = 0.1
+    time_steps = 100
+
+    state = np.zeros((n_tracks, 4))
+    state[:, 2:] = rng.normal(0.0, 1.0, (n_tracks, 2))
+    true_states = np.empty((time_steps, n_tracks, 4))
+    gps_measurements = np.empty((time_steps, n_tracks, 2))
+    imu_measurements = np.empty((time_steps, n_tracks, 2))
+    for t in range(time_steps):
+        true_states[t] = state
+        gps_measurements[t] = state[:, :2] + rng.normal(0.0, 0.5, (n_tracks, 2))
+        gps_measurements[t][rng.random(n_tracks) < gps_dropout] = np.nan
+        imu_measurements[t] = state[:, 2:] + rng.normal(0.0, 0.1, (n_tracks, 2))
+        state = state.copy()
+        state[:, :2] += state[:, 2:] * dt
+
+    # Apply the batch filter to all tracks at once
+    ekf = BatchEKF(n_tracks)
+    estimated_states = np.empty_like(true_states)
+    start = time.perf_counter()
+    for t in range(time_steps):
+        ekf.predict(dt)
+        ekf.update_gps(gps_measurements[t])
+        ekf.update_imu(imu_measurements[t])
+        estimated_states[t] = ekf.state
+    elapsed = time.perf_counter() - start
+
+    error = np.linalg.norm(estimated_states[:, :, :2] - true_states[:, :, :2], axis=2)
+    print("tracks:", n_tracks, "steps:", time_steps)
+    print("time per step: %.2f ms, %.2f us per track" % (
+        elapsed / time_steps * 1e3, elapsed / time_steps / n_tracks * 1e6))
+    print("position RMSE: %.3f m" % np.sqrt(np.mean(error ** 2)))
+
+def main_benchmark(time_steps=10000, repeat=5):
+    # Per step latency of the filters on the same measurements, best of
+    # repeat runs
+    rng = np.random.default_rng(42)
+    dt = 0.1
+    gps_measurements = rng.normal(0.0, 1.0, (time_steps, 2))
+    imu_measurements = rng.normal(0.0, 1.0, (time_steps, 2))
+
+    for make_ekf in (lambda: EKF(state_dim=4, obs_dim_gps=2, obs_dim_imu=2),
+                     FastEKF):
+        best = np.inf
+        for _ in range(repeat):
+            ekf = make_ekf()
+            start = time.perf_counter()
+            for t in range(time_steps):
+                ekf.predict(dt)
+                ekf.update_gps(gps_measurements[t])
+                ekf.update_imu(imu_measurements[t])
+            best = min(best, time.perf_counter() - start)
+        print("%s: %.1f us per step" % (type(ekf).__name__,
+                                        best / time_steps * 1e6))
+
+def main_async(duration=60.0, imu_rate=200.0, gps_rate=5.0,
+               gps_latency=0.15, jitter=0.005):
+    # IMU and GPS streams at their own rates, with timestamp jitter and a
+    # GPS latency, so GPS fixes arrive after newer IMU samples
+    rng = np.random.default_rng(42)
+    events = []  # (arrival time, timestamp, sensor)
+    for t in np.arange(0.0, duration, 1.0 / imu_rate):
+        t += rng.normal(0.0, jitter / 10)
+        events.append((t, t, 'imu'))
+    for t in np.arange(0.0, duration, 1.0 / gps_rate):
+        t += rng.normal(0.0, jitter)
+        events.append((t + gps_latency + abs(rng.normal(0.0, jitter)), t,
+                       'gps'))
+    events.sort()
+
+    # the true vehicle turns slowly, velocity (cos(w t), sin(w t))
+    w = 0.1
+    def true_state(t):
+        return np.array([np.sin(w * t) / w, (1.0 - np.cos(w * t)) / w,
+                         np.cos(w * t), np.sin(w * t)])
+
+    ekf = FastEKF()
+    ekf.state[:] = true_state(0.0)
+    scheduler = FusionScheduler(ekf, t0=0.0)
+    error = []
+    start = time.perf_counter()
+    for arrival, t, sensor in events:
+        state = true_state(t)
+        if sensor == 'imu':
+            z = state[2:] + rng.normal(0.0, 0.1, 2)
+        else:
+            z = state[:2] + rng.normal(0.0, 0.5, 2)
+        scheduler.push(t, sensor, z)
+        scheduler.process(until=arrival)
+        error.append(np.linalg.norm(ekf.state[:2] -
+                                    true_state(scheduler.t)[:2]))
+    elapsed = time.perf_counter() - start
+
+    print("measurements:", scheduler.n_measurements, "updates:",
+          scheduler.n_updates, "out of sequence:",
+          scheduler.n_out_of_sequence, "replayed:", scheduler.n_replayed,
+          "dropped:", scheduler.n_dropped)
+    print("%.0f measurements/s, %.1f x real time" % (
+        scheduler.n_measurements / elapsed, duration / elapsed))
+    print("position RMSE: %.3f m" % np.sqrt(np.mean(np.square(error))))
+
+def main_stability(time_steps=20000, n_observations=1000):
+    # Run the filter forms on the same measurements and report the health
+    # of P: asymmetry and smallest eigenvalue, which (I - K H) P lets drift
+    rng = np.random.default_rng(42)
+    dt = 0.1
+    gps_measurements = rng.normal(0.0, 1.0, (time_steps, 2))
+    imu_measurements = rng.normal(0.0, 1.0, (time_steps, 2))
+
+    # the forms must agree with EKF from a P0 that couples every state,
+    # the diagonal default P0 never exercises the cross terms of the gains.
+    # The transient is compared in lockstep, it decays within a few steps
+    A = rng.normal(0.0, 1.0, (4, 4))
+    P0 = A @ A.T + 0.1 * np.eye(4)
+    filters = [EKF(state_dim=4, obs_dim_gps=2, obs_dim_imu=2), FastEKF(),
+               SquareRootEKF(), InformationEKF()]
+    difference = np.zeros(len(filters))
+    for ekf in filters:
+        ekf.P = P0.copy()
+    for t in range(20):
+        for i, ekf in enumerate(filters):
+            ekf.predict(dt)
+            ekf.update_gps(gps_measurements[t])
+            ekf.update_imu(imu_measurements[t])
+            difference[i] = max(difference[i], np.abs(
+                ekf.state - filters[0].state).max(), np.abs(
+                ekf.P - filters[0].P).max())
+    for ekf, d in zip(filters, difference):
+        print("%s: largest difference to EKF from a correlated P0 %.1e" % (
+            type(ekf).__name__, d))
+
+    filters = [EKF(state_dim=4, obs_dim_gps=2, obs_dim_imu=2), FastEKF(),
+               SquareRootEKF(), InformationEKF()]
+    for ekf in filters:
+        start = time.perf_counter()
+        for t in range(time_steps):
+            ekf.predict(dt)
+            ekf.update_gps(gps_measurements[t])
+            ekf.update_imu(imu_measurements[t])
+        elapsed = time.perf_counter() - start
+        P = ekf.P
+        print("%s: %.1f us per step, asymmetry %.1e, min eigenvalue %.3e, "
+              "state difference to EKF %.1e" % (
+                  type(ekf).__name__, elapsed / time_steps * 1e6,
+                  np.abs(P - P.T).max(), np.linalg.eigvalsh(P).min(),
+                  np.abs(ekf.state - filters[0].state).max()))
+
+    # many simultaneous GPS fixes, e.g. from a receiver array
+    z = rng.normal(0.0, 0.5, (n_observations, 2))
+    ekf = InformationEKF()
+    start = time.perf_counter()
+    ekf.update_many(z, ekf.H_gps, ekf.R_gps)
+    elapsed_many = time.perf_counter() - start
+    ekf = InformationEKF()
+    start = time.perf_counter()
+    for z_i in z:
+        ekf.update_gps(z_i)
+    elapsed_loop = time.perf_counter() - start
+    print("%d observations: update_many %.2f ms, one by one %.2f ms" % (
+        n_observations, elapsed_many * 1e3, elapsed_loop * 1e3))
+
+if __name__ == '__main__':
+    main()
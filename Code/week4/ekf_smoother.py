@@ -0,0 +1,299 @@
+"""
+
+Offline Rauch-Tung-Striebel smoother for recorded GPS/IMU logs
+
+A forward pass of the EKF in ekfGPSIMU.py followed by a backward RTS pass.
+Logs are read and written in chunks through memory-mapped .npy files, so
+memory stays bounded for logs of any length.
+
+With a fixed time step the covariances only depend on which sensors were
+present, not on the measured values, and they quickly converge to a few
+distinct matrices. The covariance updates are therefore cached on the
+sensor pattern, and the filter and smoother gains of a whole chunk are
+computed at once, so both passes reduce to an affine recurrence of the
+4-vector state per sample. Covariance histories are stored as upper
+triangles.
+
+See H. E. Rauch, F. Tung and C. T. Striebel, "Maximum likelihood estimates
+of linear dynamic systems", AIAA Journal, 1965
+
+"""
+
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from ekfGPSIMU import EKF
+
+CHUNK_SIZE = 1 << 16  # samples per chunk read from the memory-mapped logs
+MAX_ENTRIES = 1 << 14  # covariance cache entries kept across chunks
+TRIU = np.triu_indices(4)  # covariances are stored as upper triangles
+
+
+class RTSSmoother:
+
+    def __init__(self, ekf, dt, chunk_size=CHUNK_SIZE,
+                 max_entries=MAX_ENTRIES):
+        """
+        Smoother with the model and noise of an EKF
+
+        ekf: EKF giving Q, R_gps, R_imu and the initial state and P
+        dt: time step of the log [s]
+        chunk_size: samples per chunk
+        max_entries: covariance cache size, the caches are cleared between
+            chunks when they grow larger, e.g. on irregular sensor dropouts
+        """
+        self.dt = dt
+        self.chunk_size = chunk_size
+        self.max_entries = max_entries
+        self.x0 = np.array(ekf.state, dtype=float)
+        self.P0 = np.array(ekf.P, dtype=float)
+        self.F = np.eye(4)
+        self.F[0, 2] = dt
+        self.F[1, 3] = dt
+        self.Q = np.array(ekf.Q, dtype=float)
+        # rows of [h_gps; h_imu], the observation of a sample
+        self.H = np.eye(4)
+        self.R = np.zeros((4, 4))
+        self.R[:2, :2] = ekf.R_gps
+        self.R[2:, 2:] = ekf.R_imu
+        self.sensor_rows = [np.flatnonzero(np.repeat(
+            [mask & 1, mask & 2], 2)) for mask in range(4)]
+        self.n_filtered_entries = 0  # covariances computed by the passes
+        self.n_smoothed_entries = 0
+
+    def smooth(self, gps, imu, out_dir):
+        """
+        Smooth a recorded log
+
+        gps: (T, 2) GPS positions [m], NaN where no fix was recorded. A row
+            with any NaN is skipped, as in BatchEKF
+        imu: (T, 2) IMU velocities [m/s], NaN where no sample was recorded.
+            A row with any NaN is skipped, as in BatchEKF
+        out_dir: directory of the output .npy files
+
+        output:
+            x_s: (T, 4) memory-mapped smoothed states
+            P_s: (T, 10) memory-mapped smoothed covariances, upper
+                triangles, see unpack_covariances()
+        """
+        n = gps.shape[0]
+        x_f = np.lib.format.open_memmap(
+            os.path.join(out_dir, "filtered_state.npy"), mode="w+",
+            dtype=np.float64, shape=(n, 4))
+        P_f = np.lib.format.open_memmap(
+            os.path.join(out_dir, "filtered_covariance.npy"), mode="w+",
+            dtype=np.float64, shape=(n, TRIU[0].shape[0]))
+        x_s = np.lib.format.open_memmap(
+            os.path.join(out_dir, "smoothed_state.npy"), mode="w+",
+            dtype=np.float64, shape=(n, 4))
+        P_s = np.lib.format.open_memmap(
+            os.path.join(out_dir, "smoothed_covariance.npy"), mode="w+",
+            dtype=np.float64, shape=(n, TRIU[0].shape[0]))
+
+        self.forward(gps, imu, x_f, P_f)
+        self.backward(x_f, P_f, x_s, P_s)
+        return x_s, P_s
+
+    def forward(self, gps, imu, x_f, P_f):
+        # the covariances do not depend on the measured values, so a cache
+        # of (entry, sensor mask) -> transition replaces the covariance
+        # update whenever the sensor pattern repeats. A transition holds
+        # the next entry and x_f = A x_f_prev + B z
+        x = self.x0
+        P, keys = [self.P0], {}
+        A, B, following, transitions = [], [], [], {}
+        index = 0
+        for start in range(0, gps.shape[0], self.chunk_size):
+            z = np.hstack([gps[start:start + self.chunk_size],
+                           imu[start:start + self.chunk_size]])
+            # as in BatchEKF a sensor is present only when its whole row
+            # is, a partly NaN row is dropped
+            present = ~np.isnan(z)
+            gps_present = present[:, :2].all(axis=1)
+            imu_present = present[:, 2:].all(axis=1)
+            masks = (gps_present | (imu_present << 1)).tolist()
+            z[:, :2][~gps_present] = 0.0
+            z[:, 2:][~imu_present] = 0.0
+
+            steps = []
+            for mask in masks:
+                step = transitions.get((index, mask))
+                if step is None:
+                    step = transitions[(index, mask)] = len(A)
+                    self.add_filtered(index, mask, P, keys, A, B, following)
+                index = following[step]
+                steps.append(step)
+            steps = np.array(steps, dtype=np.intp)
+
+            A_k = np.array(A)[steps]
+            Bz = np.einsum('kij,kj->ki', np.array(B)[steps], z)
+            out = x_f[start:start + steps.shape[0]]
+            for k in range(steps.shape[0]):
+                x = A_k[k] @ x + Bz[k]
+                out[k] = x
+            P_f[start:start + steps.shape[0]] = np.array(P)[
+                np.array(following)[steps]][:, TRIU[0], TRIU[1]]
+
+            if len(P) > self.max_entries:
+                P, keys = [P[index]], {}
+                A, B, following, transitions = [], [], [], {}
+                index = 0
+
+    def backward(self, x_f, P_f, x_s, P_s):
+        F, Q = self.F, self.Q
+        n = x_f.shape[0]
+        x = x_f[n - 1]
+        P, keys, following = [], {}, {}
+        index = -1
+        for stop in range(n, 0, -self.chunk_size):
+            start = max(stop - self.chunk_size, 0)
+
+            # smoother gains of the whole chunk at once
+            P_fk = unpack_covariances(P_f[start:stop])
+            P_pk = np.einsum('ij,kjl,ml->kim', F, P_fk, F) + Q
+            G = np.linalg.solve(P_pk, np.einsum('ij,kjl->kil', F, P_fk))
+            G = G.transpose(0, 2, 1)  # P_f F^T P_p^-1
+            C = np.eye(4) - G @ F
+            Cx = np.einsum('kij,kj->ki', C, x_f[start:stop])
+
+            out = x_s[start:stop]
+            k = stop - start - 1
+            if stop == n:  # the last smoothed state is the filtered one
+                x = out[k] = x_f[n - 1]
+                k -= 1
+            for k in range(k, -1, -1):
+                x = G[k] @ x + Cx[k]
+                out[k] = x
+
+            # smoothed covariances, cached on (filtered, next smoothed)
+            f_keys = [p.tobytes() for p in P_fk.astype(np.float32)]
+            indexes = []
+            for k in range(stop - start - 1, -1, -1):
+                next_index = following.get((f_keys[k], index))
+                if next_index is None:
+                    if index == -1:  # last sample
+                        P_k = P_fk[k]
+                    else:
+                        P_k = P_fk[k] + G[k] @ (P[index] - P_pk[k]) @ G[k].T
+                    next_index = self.add_entry(P_k, P, keys)
+                    self.n_smoothed_entries += 1
+                    following[(f_keys[k], index)] = next_index
+                index = next_index
+                indexes.append(index)
+            P_s[start:stop] = np.array(P)[indexes[::-1]][:, TRIU[0], TRIU[1]]
+
+            if len(P) > self.max_entries:
+                P, keys, following = [P[index]], {}, {}
+                index = 0
+
+    def add_filtered(self, index, mask, P, keys, A, B, following):
+        # prediction and joint update of the present sensors, Joseph form
+        F = self.F
+        P_p = F @ P[index] @ F.T + self.Q
+        rows = self.sensor_rows[mask]
+        H, R = self.H[rows], self.R[np.ix_(rows, rows)]
+        S = H @ P_p @ H.T + R
+        K = np.linalg.solve(S, H @ P_p).T
+        IKH = np.eye(4) - K @ H
+        following.append(
+            self.add_entry(IKH @ P_p @ IKH.T + K @ R @ K.T, P, keys))
+        A.append(IKH @ F)
+        B_k = np.zeros((4, 4))
+        B_k[:, rows] = K
+        B.append(B_k)
+        self.n_filtered_entries += 1
+
+    @staticmethod
+    def add_entry(P_k, P, keys):
+        # covariances equal to float32 precision share an entry, so the
+        # converging covariance sequence ends in a fixed point or cycle
+        key = P_k.astype(np.float32).tobytes()
+        index = keys.get(key)
+        if index is None:
+            index = len(P)
+            keys[key] = index
+            P.append(P_k)
+        return index
+
+
+def unpack_covariances(packed):
+    """
+    (n, 10) upper triangles to (n, 4, 4) covariances
+    """
+    packed = np.asarray(packed)
+    P = np.empty((packed.shape[0], 4, 4))
+    P[:, TRIU[0], TRIU[1]] = packed
+    P[:, TRIU[1], TRIU[0]] = packed
+    return P
+
+
+def simulate_log(log_dir, n_samples, dt, gps_every=10, seed=42):
+    # a slowly turning vehicle, IMU every sample and GPS every gps_every
+    # samples, written chunk by chunk to memory-mapped logs
+    rng = np.random.default_rng(seed)
+    truth = np.lib.format.open_memmap(
+        os.path.join(log_dir, "truth.npy"), mode="w+", dtype=np.float64,
+        shape=(n_samples, 2))
+    gps = np.lib.format.open_memmap(
+        os.path.join(log_dir, "gps.npy"), mode="w+", dtype=np.float64,
+        shape=(n_samples, 2))
+    imu = np.lib.format.open_memmap(
+        os.path.join(log_dir, "imu.npy"), mode="w+", dtype=np.float64,
+        shape=(n_samples, 2))
+    w = 0.01
+    for start in range(0, n_samples, CHUNK_SIZE):
+        t = np.arange(start, min(start + CHUNK_SIZE, n_samples)) * dt
+        position = np.stack([np.sin(w * t), 1.0 - np.cos(w * t)], axis=1) / w
+        velocity = np.stack([np.cos(w * t), np.sin(w * t)], axis=1)
+        truth[start:start + t.shape[0]] = position
+        g = position + rng.normal(0.0, 0.5, position.shape)
+        g[(np.arange(t.shape[0]) + start) % gps_every != 0] = np.nan
+        gps[start:start + t.shape[0]] = g
+        imu[start:start + t.shape[0]] = velocity + rng.normal(
+            0.0, 0.1, velocity.shape)
+    return truth, gps, imu
+
+
+def main(hours=1.0, rate=100.0):
+    print(__file__ + " start!!")
+
+    dt = 1.0 / rate
+    n_samples = int(hours * 3600 * rate)
+    with tempfile.TemporaryDirectory() as log_dir:
+        truth, gps, imu = simulate_log(log_dir, n_samples, dt)
+        # read back as a recorded log would be
+        truth = np.load(os.path.join(log_dir, "truth.npy"), mmap_mode="r")
+        gps = np.load(os.path.join(log_dir, "gps.npy"), mmap_mode="r")
+        imu = np.load(os.path.join(log_dir, "imu.npy"), mmap_mode="r")
+
+        ekf = EKF(state_dim=4, obs_dim_gps=2, obs_dim_imu=2)
+        ekf.state[:] = [0.0, 0.0, 1.0, 0.0]
+        smoother = RTSSmoother(ekf, dt)
+        start = time.perf_counter()
+        x_s, P_s = smoother.smooth(gps, imu, log_dir)
+        elapsed = time.perf_counter() - start
+
+        x_f = np.load(os.path.join(log_dir, "filtered_state.npy"),
+                      mmap_mode="r")
+        filtered_error, smoothed_error = 0.0, 0.0
+        for k in range(0, n_samples, CHUNK_SIZE):
+            true_position = truth[k:k + CHUNK_SIZE]
+            filtered_error += np.sum(
+                (x_f[k:k + CHUNK_SIZE, :2] - true_position) ** 2)
+            smoothed_error += np.sum(
+                (x_s[k:k + CHUNK_SIZE, :2] - true_position) ** 2)
+        print("samples:", n_samples, "covariances computed:",
+              smoother.n_filtered_entries, smoother.n_smoothed_entries)
+        print("%.1f s, %.2f M samples per minute" % (
+            elapsed, n_samples / elapsed * 60 / 1e6))
+        print("position RMSE: filtered %.3f m, smoothed %.3f m" % (
+            np.sqrt(filtered_error / n_samples),
+            np.sqrt(smoothed_error / n_samples)))
+        del truth, gps, imu, x_f, x_s, P_s
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,447 @@
+"""
+
+Hierarchical path-finding A* (HPA*) grid planning
+
+The grid of AStarPlanner is split into square clusters. Entrances between
+neighboring clusters become the nodes of an abstract graph whose edges are
+the costs of crossing a cluster from one entrance to another, precomputed
+once. A query searches the small abstract graph and then refines only the
+clusters along the chosen corridor into grid cells, so long queries on
+large maps take milliseconds instead of seconds. The paths are near
+optimal: they cross cluster borders only at the entrances.
+
+See A. Botea, M. Muller and J. Schaeffer, "Near optimal hierarchical
+path-finding", Journal of Game Development, 2004
+
+"""
+
+import heapq
+import itertools
+import math
+import time
+from collections import OrderedDict
+
+import matplotlib.pyplot as plt
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from astar import AStarPlanner
+
+show_animation = True
+
+CLUSTER_SIZE = 16  # cluster edge length [cells]
+ENTRANCE_SPLIT = 6  # entrances at least this wide get a transition per end
+MAX_SEGMENTS = 4096  # refined segments kept for later queries
+MAX_CLUSTER_GRAPHS = 256  # cluster grid graphs kept for later queries
+
+
+class HPAStarPlanner(AStarPlanner):
+
+    def __init__(self, ox, oy, resolution, rr, cluster_size=CLUSTER_SIZE,
+                 max_segments=MAX_SEGMENTS,
+                 max_cluster_graphs=MAX_CLUSTER_GRAPHS):
+        """
+        Initialize grid map and abstract graph for HPA* planning
+
+        ox: x position list of Obstacles [m]
+        oy: y position list of Obstacles [m]
+        resolution: grid resolution [m]
+        rr: robot radius[m]
+        cluster_size: cluster edge length [cells]
+        max_segments: refined segments kept, least recently used first out
+        max_cluster_graphs: cluster grid graphs kept, least recently used
+            first out
+        """
+        super().__init__(ox, oy, resolution, rr)
+        self.cluster_size = cluster_size
+        self.n_cluster_x = -(-self.x_width // cluster_size)
+        self.n_cluster_y = -(-self.y_width // cluster_size)
+        self.max_segments = max_segments
+        self.max_cluster_graphs = max_cluster_graphs
+
+        # abstract graph: grid index -> {grid index: cost}
+        self.graph = dict()
+        self.cluster_nodes = dict()  # cluster -> list of node grid indexes
+        # (node, node) -> refined grid indexes, in order of last use
+        self.segments = OrderedDict()
+        # cluster -> (graph, (x0, y0, w)), in order of last use
+        self.cluster_graphs = OrderedDict()
+
+        start = time.perf_counter()
+        self.calc_entrances()
+        self.calc_intra_edges()
+        print("abstract graph:", len(self.graph), "nodes,",
+              sum(len(edges) for edges in self.graph.values()), "edges,",
+              "%.3f s" % (time.perf_counter() - start))
+
+    def calc_cluster(self, x, y):
+        return (y // self.cluster_size) * self.n_cluster_x + \
+            x // self.cluster_size
+
+    def calc_cluster_bounds(self, cluster):
+        cy, cx = divmod(cluster, self.n_cluster_x)
+        x0, y0 = cx * self.cluster_size, cy * self.cluster_size
+        return (x0, y0, min(x0 + self.cluster_size, self.x_width),
+                min(y0 + self.cluster_size, self.y_width))
+
+    def calc_cluster_graph(self, cluster):
+        """
+        Sparse graph of the grid cells inside a cluster
+
+        The cell (x, y) is the vertex (y - y0) * w + (x - x0) of the
+        cluster's bounding box (x0, y0, x0 + w, y0 + h). As in planning,
+        an edge exists when its target cell is not an obstacle.
+        """
+        x0, y0, x1, y1 = self.calc_cluster_bounds(cluster)
+        w, h = x1 - x0, y1 - y0
+        free = ~np.asarray(self.obstacle_map[x0:x1, y0:y1])
+        lx, ly = np.meshgrid(np.arange(w), np.arange(h), indexing="ij")
+
+        rows, cols, costs = [], [], []
+        for dx, dy, dc in self.motion:
+            tx, ty = lx + dx, ly + dy
+            ok = (tx >= 0) & (tx < w) & (ty >= 0) & (ty < h)
+            ok[ok] = free[tx[ok], ty[ok]]
+            rows.append(ly[ok] * w + lx[ok])
+            cols.append(ty[ok] * w + tx[ok])
+            costs.append(np.full(cols[-1].shape[0], dc))
+        graph = csr_matrix((np.concatenate(costs), (np.concatenate(rows),
+                                                    np.concatenate(cols))),
+                           shape=(w * h, w * h))
+        return graph, (x0, y0, w)
+
+    def get_cluster_graph(self, cluster):
+        """
+        calc_cluster_graph, kept in a bounded LRU for later queries
+        """
+        if cluster in self.cluster_graphs:
+            self.cluster_graphs.move_to_end(cluster)
+            return self.cluster_graphs[cluster]
+        graph = self.cluster_graphs[cluster] = self.calc_cluster_graph(
+            cluster)
+        if len(self.cluster_graphs) > self.max_cluster_graphs:
+            self.cluster_graphs.popitem(last=False)
+        return graph
+
+    def calc_entrances(self):
+        """
+        Transition cell pairs on every border between two clusters
+
+        Every maximal run of border cells that are free on both sides is
+        an entrance. Narrow entrances get one transition in the middle,
+        wide ones one at each end. Diagonal moves between two clusters that
+        cut the corner of two obstacles are entrances of their own, every
+        other diagonal crossing can be replaced by two straight moves.
+        """
+        free = ~np.asarray(self.obstacle_map)
+        cs = self.cluster_size
+
+        def add_runs(both_free, a_of, b_of):
+            # both_free: bool array along a border segment, a_of(i) and
+            # b_of(i): grid cells on either side of position i
+            padded = np.concatenate(([False], both_free, [False]))
+            edges = np.flatnonzero(padded[1:] != padded[:-1])
+            for r0, r1 in zip(edges[::2].tolist(), edges[1::2].tolist()):
+                if r1 - r0 < ENTRANCE_SPLIT:
+                    positions = [r0 + (r1 - r0 - 1) // 2]
+                else:
+                    positions = [r0, r1 - 1]
+                for i in positions:
+                    self.add_edge(a_of(i), b_of(i), 1.0)
+                    self.add_edge(b_of(i), a_of(i), 1.0)
+
+        # vertical borders between x = b - 1 and x = b
+        for b in range(cs, self.x_width, cs):
+            for y0 in range(0, self.y_width, cs):
+                y1 = min(y0 + cs, self.y_width)
+                add_runs(free[b - 1, y0:y1] & free[b, y0:y1],
+                         lambda i: (b - 1, y0 + i), lambda i: (b, y0 + i))
+        # horizontal borders between y = b - 1 and y = b
+        for b in range(cs, self.y_width, cs):
+            for x0 in range(0, self.x_width, cs):
+                x1 = min(x0 + cs, self.x_width)
+                add_runs(free[x0:x1, b - 1] & free[x0:x1, b],
+                         lambda i: (x0 + i, b - 1), lambda i: (x0 + i, b))
+
+        # corner cutting diagonal moves across a border
+        x, y = np.meshgrid(np.arange(self.x_width), np.arange(self.y_width),
+                           indexing="ij")
+        padded = np.zeros((self.x_width + 2, self.y_width + 2), dtype=bool)
+        padded[1:-1, 1:-1] = free
+        for dx, dy, dc in self.motion:
+            if dx == 0 or dy == 0:
+                continue
+            tx, ty = x + dx, y + dy
+            cut = (free & padded[tx + 1, ty + 1] & ~padded[tx + 1, y + 1] &
+                   ~padded[x + 1, ty + 1] &
+                   ((x // cs != tx // cs) | (y // cs != ty // cs)))
+            for ux, uy in zip(x[cut].tolist(), y[cut].tolist()):
+                self.add_edge((ux, uy), (ux + dx, uy + dy), dc)
+
+    def add_edge(self, a, b, cost):
+        a_id, b_id = a[1] * self.x_width + a[0], b[1] * self.x_width + b[0]
+        for node, (x, y) in ((a_id, a), (b_id, b)):
+            if node not in self.graph:
+                self.graph[node] = dict()
+                self.cluster_nodes.setdefault(
+                    self.calc_cluster(x, y), []).append(node)
+        if cost < self.graph[a_id].get(b_id, math.inf):
+            self.graph[a_id][b_id] = cost
+
+    def calc_intra_edges(self):
+        # entrance to entrance costs inside every cluster
+        for cluster, nodes in self.cluster_nodes.items():
+            graph, (x0, y0, w) = self.get_cluster_graph(cluster)
+            local = [self.calc_local_index(node, x0, y0, w) for node in nodes]
+            dist = dijkstra(graph, indices=local)[:, local]
+            for i, a in enumerate(nodes):
+                edges = self.graph[a]
+                for j, b in enumerate(nodes):
+                    if i != j and np.isfinite(dist[i, j]) and \
+                            dist[i, j] < edges.get(b, math.inf):
+                        edges[b] = float(dist[i, j])
+
+    def calc_local_index(self, index, x0, y0, w):
+        y, x = divmod(index, self.x_width)
+        return (y - y0) * w + (x - x0)
+
+    def calc_global_index(self, local, x0, y0, w):
+        y, x = divmod(local, w)
+        return (y + y0) * self.x_width + x + x0
+
+    def planning(self, sx, sy, gx, gy):
+        """
+        HPA* path search
+
+        input:
+            s_x: start x position [m]
+            s_y: start y position [m]
+            gx: goal x position [m]
+            gy: goal y position [m]
+
+        output:
+            rx: x position list of the final path, empty if there is none
+            ry: y position list of the final path, empty if there is none
+        """
+        start_node = self.Node(self.calc_xy_index(sx, self.min_x),
+                               self.calc_xy_index(sy, self.min_y), 0.0, -1)
+        goal_node = self.Node(self.calc_xy_index(gx, self.min_x),
+                              self.calc_xy_index(gy, self.min_y), 0.0, -1)
+        if not (self.in_grid(start_node) and self.in_grid(goal_node)):
+            print("Start or goal is outside of the grid..")
+            return [], []
+        start_id = self.calc_grid_index(start_node)
+        goal_id = self.calc_grid_index(goal_node)
+
+        # connect start and goal to the entrances of their clusters, and
+        # to each other when they share a cluster
+        start_edges = {start_id: self.calc_endpoint_edges(
+            start_node, goal_id, False)}
+        goal_edges = self.calc_endpoint_edges(goal_node, start_id, True)
+        if self.obstacle_map[start_node.x, start_node.y]:
+            # planning lets a start inside an obstacle step out of it,
+            # also into a neighbor cluster without passing an entrance
+            for dx, dy, dc in self.motion:
+                node = self.Node(start_node.x + dx, start_node.y + dy, 0.0,
+                                 -1)
+                if not self.verify_node(node) or \
+                        self.calc_cluster(node.x, node.y) == \
+                        self.calc_cluster(start_node.x, start_node.y):
+                    continue
+                n_id = self.calc_grid_index(node)
+                start_edges[start_id][n_id] = dc
+                start_edges[n_id] = self.calc_endpoint_edges(node, goal_id,
+                                                             False)
+
+        abstract_path = self.abstract_planning(start_id, goal_id,
+                                               start_edges, goal_edges)
+        if not abstract_path:
+            print("Open set is empty..")
+            return [], []
+        print("Find goal")
+
+        return self.refine_path(abstract_path)
+
+    def calc_endpoint_edges(self, node, other_id, reverse):
+        # costs from the node to the entrances of its cluster and to
+        # other_id if it is in the cluster, or from them if reverse
+        cluster = self.calc_cluster(node.x, node.y)
+        graph, (x0, y0, w) = self.get_cluster_graph(cluster)
+        if reverse:
+            graph = graph.T  # a view, searched as costs into the node
+        node_id = self.calc_grid_index(node)
+        dist = dijkstra(graph, indices=self.calc_local_index(
+            node_id, x0, y0, w))
+        others = list(self.cluster_nodes.get(cluster, []))
+        other_y, other_x = divmod(other_id, self.x_width)
+        if self.calc_cluster(other_x, other_y) == cluster:
+            others.append(other_id)
+        edges = dict()
+        for other in others:
+            d = dist[self.calc_local_index(other, x0, y0, w)]
+            if np.isfinite(d):
+                edges[other] = float(d)
+        return edges
+
+    def abstract_planning(self, start_id, goal_id, start_edges, goal_edges):
+        """
+        A star search over the abstract graph
+
+        start_edges: {node: {node: cost}} out of the start and the cells
+            it reaches without an entrance
+        goal_edges: {node: cost} into the goal
+        return: grid indexes from the start to the goal, empty on failure
+        """
+        goal_y, goal_x = divmod(goal_id, self.x_width)
+
+        def heuristic(index):
+            y, x = divmod(index, self.x_width)
+            return math.hypot(goal_x - x, goal_y - y)
+
+        cost, parent, closed = {start_id: 0.0}, {start_id: -1}, set()
+        h = heuristic(start_id)
+        open_heap = [(h, h, start_id)]
+        n_closed = 0
+        while open_heap:
+            _, _, c_id = heapq.heappop(open_heap)
+            if c_id in closed:
+                continue
+            if c_id == goal_id:
+                break
+            closed.add(c_id)
+            n_closed += 1
+
+            edges = self.graph.get(c_id, {}).items()
+            if c_id in start_edges:
+                edges = itertools.chain(edges, start_edges[c_id].items())
+            if c_id in goal_edges:
+                edges = itertools.chain(edges,
+                                        ((goal_id, goal_edges[c_id]),))
+            for n_id, dc in edges:
+                if n_id in closed:
+                    continue
+                n_cost = cost[c_id] + dc
+                if n_cost < cost.get(n_id, math.inf):
+                    cost[n_id] = n_cost
+                    parent[n_id] = c_id
+                    h = heuristic(n_id)
+                    heapq.heappush(open_heap, (n_cost + h, h, n_id))
+        self.n_expanded = n_closed
+
+        if goal_id not in parent:
+            return []
+        path = [goal_id]
+        while parent[path[-1]] != -1:
+            path.append(parent[path[-1]])
+        return path[::-1]
+
+    def refine_path(self, abstract_path):
+        """
+        Grid cells of an abstract path, only the crossed clusters are
+        searched. Segments between two entrances are kept for later
+        queries.
+
+        return: rx, ry from the goal to the start as planning
+        """
+        path = [abstract_path[0]]
+        for a, b in zip(abstract_path[:-1], abstract_path[1:]):
+            a_y, a_x = divmod(a, self.x_width)
+            b_y, b_x = divmod(b, self.x_width)
+            cluster = self.calc_cluster(a_x, a_y)
+            if cluster != self.calc_cluster(b_x, b_y):  # entrance step
+                path.append(b)
+                continue
+            if (a, b) in self.segments:
+                self.segments.move_to_end((a, b))
+                path.extend(self.segments[a, b])
+                continue
+            graph, (x0, y0, w) = self.get_cluster_graph(cluster)
+            a_local = self.calc_local_index(a, x0, y0, w)
+            b_local = self.calc_local_index(b, x0, y0, w)
+            _, predecessors = dijkstra(graph, indices=a_local,
+                                       return_predecessors=True)
+            segment = []
+            local = b_local
+            while local != a_local:
+                segment.append(self.calc_global_index(local, x0, y0, w))
+                local = predecessors[local]
+            segment.reverse()
+            if a in self.graph and b in self.graph:
+                self.segments[a, b] = segment
+                if len(self.segments) > self.max_segments:
+                    self.segments.popitem(last=False)
+            path.extend(segment)
+
+        rx, ry = [], []
+        for index in reversed(path):
+            y, x = divmod(index, self.x_width)
+            rx.append(self.calc_grid_position(x, self.min_x))
+            ry.append(self.calc_grid_position(y, self.min_y))
+        return rx, ry
+
+
+def main():
+    print(__file__ + " start!!")
+
+    # start and goal position
+    sx = 10.0  # [m]
+    sy = 10.0  # [m]
+    gx = 50.0  # [m]
+    gy = 50.0  # [m]
+    grid_size = 2.0  # [m]
+    robot_radius = 1.0  # [m]
+
+    # set obstacle positions
+    ox, oy = [], []
+    for i in range(-10, 60):
+        ox.append(i)
+        oy.append(-10.0)
+    for i in range(-10, 60):
+        ox.append(60.0)
+        oy.append(i)
+    for i in range(-10, 61):
+        ox.append(i)
+        oy.append(60.0)
+    for i in range(-10, 61):
+        ox.append(-10.0)
+        oy.append(i)
+    for i in range(-10, 40):
+        ox.append(20.0)
+        oy.append(i)
+    for i in range(0, 40):
+        ox.append(40.0)
+        oy.append(60.0 - i)
+
+    if show_animation:  # pragma: no cover
+        plt.plot(ox, oy, ".k")
+        plt.plot(sx, sy, "og")
+        plt.plot(gx, gy, "xb")
+        plt.grid(True)
+        plt.axis("equal")
+
+    hpa_star = HPAStarPlanner(ox, oy, grid_size, robot_radius, cluster_size=8)
+    rx, ry = hpa_star.planning(sx, sy, gx, gy)
+
+    if show_animation:  # pragma: no cover
+        # cluster borders and entrances
+        for b in range(0, hpa_star.x_width + 1, hpa_star.cluster_size):
+            x = hpa_star.calc_grid_position(b - 0.5, hpa_star.min_x)
+            plt.plot([x, x], [hpa_star.min_y, hpa_star.max_y], "-",
+                     color="0.8")
+        for b in range(0, hpa_star.y_width + 1, hpa_star.cluster_size):
+            y = hpa_star.calc_grid_position(b - 0.5, hpa_star.min_y)
+            plt.plot([hpa_star.min_x, hpa_star.max_x], [y, y], "-",
+                     color="0.8")
+        nodes = np.array(list(hpa_star.graph.keys()))
+        plt.plot(hpa_star.calc_grid_position(nodes % hpa_star.x_width,
+                                             hpa_star.min_x),
+                 hpa_star.calc_grid_position(nodes // hpa_star.x_width,
+                                             hpa_star.min_y), "sm")
+        plt.plot(rx, ry, "-r")
+        plt.pause(0.001)
+        plt.show()
+
+
+if __name__ == '__main__':
+    main()